@@ -18,6 +18,6 @@
 
 import sys
 
-from hun_law.cli import GenerateCommand
+from hun_law.cli import main
 
-GenerateCommand().run(sys.argv[1:])
+main(sys.argv[1:])
@@ -0,0 +1,93 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+
+# Access to act_to_mk_issue.csv, which lists the Magyar Közlöny issue of every Act.
+# See generate_act_to_mk_issue.py for how it was created.
+
+import csv
+import os
+from typing import Container, Counter, Iterable, List, Optional, Tuple
+
+import attr
+
+from hun_law.extractors.kozlonyok_hu_downloader import KozlonyToDownload
+
+DEFAULT_CSV_PATH = os.path.join(os.path.dirname(__file__), '..', 'act_to_mk_issue.csv')
+
+# Used to estimate the cost of processing issues that are not downloaded yet.
+AVERAGE_ISSUE_SIZE_PER_ACT = 200 * 1024
+
+IssueId = Tuple[int, int]
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class ActInIssue:
+    year: int
+    issue: int
+    identifier: str
+    subject: str
+
+    @property
+    def issue_id(self) -> IssueId:
+        return (self.year, self.issue)
+
+
+def load_act_to_mk_issue(path: str = DEFAULT_CSV_PATH) -> List[ActInIssue]:
+    with open(path, newline='', encoding='utf-8') as f:
+        return [ActInIssue(int(year), int(issue), identifier, subject) for year, issue, identifier, subject in csv.reader(f)]
+
+
+def find_issue_of_act(identifier: str, acts: Optional[Iterable[ActInIssue]] = None) -> Optional[IssueId]:
+    if acts is None:
+        acts = load_act_to_mk_issue()
+    for act in acts:
+        if act.identifier == identifier:
+            return act.issue_id
+    return None
+
+
+def estimate_issue_cost(issue_id: IssueId, act_count: int) -> int:
+    """Estimates the cost of processing an issue, based on its size."""
+    cache_object = KozlonyToDownload(*issue_id).get_cache_object()
+    if cache_object.exists():
+        return cache_object.size_on_disk()
+    return act_count * AVERAGE_ISSUE_SIZE_PER_ACT
+
+
+def select_issues(
+        acts: Iterable[ActInIssue],
+        *,
+        from_year: Optional[int] = None,
+        to_year: Optional[int] = None,
+        act_identifiers: Optional[Container[str]] = None
+) -> List[IssueId]:
+    """Returns the issues that contain the selected Acts, the most expensive ones first.
+
+    Processing the biggest issues first makes the work distribution between worker processes
+    more even, because the small issues at the end can fill the gaps.
+    """
+    act_counts: Counter[IssueId] = Counter()
+    for act in acts:
+        if from_year is not None and act.year < from_year:
+            continue
+        if to_year is not None and act.year > to_year:
+            continue
+        if act_identifiers is not None and act.identifier not in act_identifiers:
+            continue
+        act_counts[act.issue_id] += 1
+    # Sort by issue id first, so that the order is deterministic for equal costs
+    return sorted(sorted(act_counts), key=lambda issue_id: estimate_issue_cost(issue_id, act_counts[issue_id]), reverse=True)
@@ -0,0 +1,193 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+
+# Compact binary serialization of pages of IndentedLines, for caching parsed PDFs.
+# It is way faster to decode than gzipped JSON, because everything is stored in
+# flat arrays, which can be loaded without any per-element parsing.
+#
+# Layout (all integers and floats are little endian):
+#   Header: magic, format version, number of strings, number of pages, number of skipped ranges
+#   String table: byte length of every string, then all strings in UTF-8, concatenated
+#   Skipped page ranges: (start, end) pairs
+#   Page index: offset of every page from the start of the page area, plus the end offset
+#   Pages, each of them compressed separately with zlib, so that they can be decoded
+#   independently. Uncompressed contents of a page:
+#       Header: number of lines, number of parts
+#       Number of parts in every line
+#       margin_right of every line
+#       dx of every part
+#       Index of the content string of every part
+#       bold flag of every part
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+from typing import List, Sequence, Tuple, Dict, Iterable, Union
+
+import attr
+
+from hun_law.utils import IndentedLine, IndentedLinePartInterner, EMPTY_LINE
+
+MAGIC = b'HLPL'
+FORMAT_VERSION = 1
+
+# Fast compression: decompression speed does not depend on the level much,
+# but the file size is not that important either.
+COMPRESSION_LEVEL = 1
+
+HEADER_STRUCT = struct.Struct('<4sHIII')
+PAGE_HEADER_STRUCT = struct.Struct('<II')
+
+Buffer = Union[bytes, memoryview, mmap.mmap]
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class PagesOfLines:
+    pages: Tuple[Tuple[IndentedLine, ...], ...]
+    skipped_page_ranges: Tuple[Tuple[int, int], ...] = ()
+
+
+def _array_to_bytes(arr: array) -> bytes:
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _array_from_buffer(typecode: str, data: Buffer, offset: int, count: int) -> Tuple[array, int]:
+    result = array(typecode)
+    end = offset + count * result.itemsize
+    result.frombytes(data[offset:end])
+    if sys.byteorder != 'little':
+        result.byteswap()
+    return result, end
+
+
+class _StringTable:
+    def __init__(self) -> None:
+        self.strings: List[str] = []
+        self.indexes: Dict[str, int] = {}
+
+    def index(self, s: str) -> int:
+        result = self.indexes.get(s)
+        if result is None:
+            result = len(self.strings)
+            self.strings.append(s)
+            self.indexes[s] = result
+        return result
+
+    def to_bytes(self) -> bytes:
+        encoded = [s.encode('utf-8') for s in self.strings]
+        return _array_to_bytes(array('I', (len(e) for e in encoded))) + b''.join(encoded)
+
+
+def _encode_page(lines: Sequence[IndentedLine], string_table: _StringTable) -> bytes:
+    part_counts = array('I')
+    margin_rights = array('d')
+    dxs = array('d')
+    content_indexes = array('I')
+    bolds = bytearray()
+    for line in lines:
+        part_counts.append(len(line.parts))
+        margin_rights.append(line.margin_right)
+        for part in line.parts:
+            dxs.append(part.dx)
+            content_indexes.append(string_table.index(part.content))
+            bolds.append(part.bold)
+    return zlib.compress(b''.join((
+        PAGE_HEADER_STRUCT.pack(len(part_counts), len(dxs)),
+        _array_to_bytes(part_counts),
+        _array_to_bytes(margin_rights),
+        _array_to_bytes(dxs),
+        _array_to_bytes(content_indexes),
+        bytes(bolds),
+    )), COMPRESSION_LEVEL)
+
+
+def encode(pages: Iterable[Sequence[IndentedLine]], skipped_page_ranges: Iterable[Tuple[int, int]] = ()) -> bytes:
+    string_table = _StringTable()
+    encoded_pages = [_encode_page(page, string_table) for page in pages]
+    page_offsets = array('Q', [0])
+    for encoded_page in encoded_pages:
+        page_offsets.append(page_offsets[-1] + len(encoded_page))
+    flat_skipped_ranges = array('I', (n for r in skipped_page_ranges for n in r))
+    return b''.join([
+        HEADER_STRUCT.pack(MAGIC, FORMAT_VERSION, len(string_table.strings), len(encoded_pages), len(flat_skipped_ranges) // 2),
+        string_table.to_bytes(),
+        _array_to_bytes(flat_skipped_ranges),
+        _array_to_bytes(page_offsets),
+    ] + encoded_pages)
+
+
+class Decoder:
+    """Decodes data created by encode(). Pages can be decoded one by one, in any order."""
+
+    def __init__(self, data: Buffer):
+        self.data = data
+        magic, version, string_count, self.page_count, skipped_range_count = HEADER_STRUCT.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a binary lines file")
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported binary lines file version: {}".format(version))
+        string_lengths, offset = _array_from_buffer('I', data, HEADER_STRUCT.size, string_count)
+        self.strings: List[str] = []
+        for string_length in string_lengths:
+            self.strings.append(bytes(data[offset:offset + string_length]).decode('utf-8'))
+            offset += string_length
+        flat_skipped_ranges, offset = _array_from_buffer('I', data, offset, skipped_range_count * 2)
+        self.skipped_page_ranges = tuple(zip(flat_skipped_ranges[::2], flat_skipped_ranges[1::2]))
+        self.page_offsets, self.pages_start = _array_from_buffer('Q', data, offset, self.page_count + 1)
+        self.interner = IndentedLinePartInterner()
+
+    def decode_page(self, index: int) -> Tuple[IndentedLine, ...]:
+        # pylint: disable=too-many-locals
+        # The arrays of the page are unpacked into locals once, instead of being accessed through an object in the loop.
+        page_data = zlib.decompress(self.data[self.pages_start + self.page_offsets[index]:self.pages_start + self.page_offsets[index + 1]])
+        line_count, part_count = PAGE_HEADER_STRUCT.unpack_from(page_data, 0)
+        part_counts, offset = _array_from_buffer('I', page_data, PAGE_HEADER_STRUCT.size, line_count)
+        margin_rights, offset = _array_from_buffer('d', page_data, offset, line_count)
+        dxs, offset = _array_from_buffer('d', page_data, offset, part_count)
+        content_indexes, offset = _array_from_buffer('I', page_data, offset, part_count)
+        bolds = page_data[offset:offset + part_count]
+
+        strings = self.strings
+        make_part = self.interner.get
+        lines = []
+        part_index = 0
+        for line_part_count, margin_right in zip(part_counts, margin_rights):
+            if line_part_count == 0 and margin_right == 0:
+                lines.append(EMPTY_LINE)
+                continue
+            end = part_index + line_part_count
+            parts = tuple(
+                make_part(dx, strings[content_index], bold != 0)
+                for dx, content_index, bold in zip(dxs[part_index:end], content_indexes[part_index:end], bolds[part_index:end])
+            )
+            lines.append(IndentedLine(parts, margin_right))
+            part_index = end
+        return tuple(lines)
+
+    def decode(self) -> PagesOfLines:
+        return PagesOfLines(
+            tuple(self.decode_page(i) for i in range(self.page_count)),
+            self.skipped_page_ranges,
+        )
+
+
+def decode(data: Buffer) -> PagesOfLines:
+    return Decoder(data).decode()
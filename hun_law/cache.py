@@ -15,46 +15,630 @@
 # You should have received a copy of the GNU General Public License
 # along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
 
+import atexit
+import contextlib
+import glob
 import gzip
+import mmap
 import os
 import json
-from typing import Any
+import secrets
+import sqlite3
+import threading
+import time
+import urllib.parse
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, TypeVar, Union, cast
+
+import attr
+
+from hun_law.cache_keys import ParsedCacheKey
+from hun_law.cache_metrics import update_metrics, measure_time
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows. Locking is skipped there.
+    fcntl = None  # type: ignore
 
 cache_dir_path = None
+# Searched in order, after cache_dir_path
+read_only_cache_dir_paths: Tuple[str, ...] = ()
+
+# Environment variables for the default cache locations. See get_default_cache_dirs()
+CACHE_DIR_ENV_VAR = 'HUN_LAW_CACHE_DIR'
+READ_ONLY_CACHE_DIRS_ENV_VAR = 'HUN_LAW_READ_ONLY_CACHE_DIRS'
+
+ReadBuffer = Union[bytes, mmap.mmap]
+
+SQLITE_DB_FILENAME = 'cache.sqlite'
+LOCK_DIR = '.locks'
+# Files are written under a temporary name first, like MK/2013/.31.pdf.parsed.bin.a1b2c3.tmp
+TEMP_FILE_SUFFIX = '.tmp'
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class CacheEntryInfo:
+    name: str
+    size: int
+    # Unix timestamp of the last read or write
+    accessed: float
+
+
+class CacheBackend(ABC):
+    """Storage of the cache entries. Entries are identified by their name, which
+    is a relative path, like MK/2013/31.pdf"""
+
+    @abstractmethod
+    def exists(self, name: str) -> bool:
+        """Returns True if the entry is stored in this backend"""
+
+    @abstractmethod
+    def read_bytes(self, name: str) -> bytes:
+        """Returns the contents of the entry. Raises FileNotFoundError if it does not exist"""
+
+    @abstractmethod
+    def read_buffer(self, name: str) -> ReadBuffer:
+        """Like read_bytes, but may return an mmap instead of reading the whole entry"""
+
+    @abstractmethod
+    def write_bytes(self, name: str, data: bytes) -> None:
+        """Stores the entry, replacing any previous version"""
+
+    @abstractmethod
+    def delete(self, name: str) -> None:
+        """Removes the entry, if it exists"""
+
+    @abstractmethod
+    def size(self, name: str) -> int:
+        """Size of the stored entry in bytes"""
+
+    @abstractmethod
+    def names_with_prefix(self, prefix: str) -> Iterable[str]:
+        """Names of all entries starting with prefix"""
+
+    @abstractmethod
+    def list_entries(self) -> Iterable[CacheEntryInfo]:
+        pass
+
+    def flush(self) -> None:
+        """Makes sure every write is persisted"""
+
+
+class FilesystemCacheBackend(CacheBackend):
+    """Stores every entry in its own file in the cache directory.
+
+    In read_only mode, the access times of the files are not updated.
+    """
+
+    def __init__(self, cache_dir: str, read_only: bool = False):
+        self.cache_dir = cache_dir
+        self.read_only = read_only
+
+    def get_filename(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self.get_filename(name))
+
+    def read_bytes(self, name: str) -> bytes:
+        with open(self.get_filename(name), 'rb') as f:
+            self.mark_accessed(f.fileno())
+            return f.read()
+
+    def read_buffer(self, name: str) -> ReadBuffer:
+        with open(self.get_filename(name), 'rb') as f:
+            self.mark_accessed(f.fileno())
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def mark_accessed(self, fd: int) -> None:
+        if self.read_only:
+            return
+        # The access time is set explicitly, because most filesystems are mounted with
+        # noatime or relatime, and the modification time is kept, because the downloader uses it.
+        os.utime(fd, ns=(time.time_ns(), os.stat(fd).st_mtime_ns))
+
+    def check_writable(self) -> None:
+        if self.read_only:
+            raise PermissionError("Cannot modify read-only cache {}".format(self.cache_dir))
+
+    def write_bytes(self, name: str, data: bytes) -> None:
+        self.check_writable()
+        filename = self.get_filename(name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # Write to a temporary file and rename it, so that concurrent readers either see
+        # the old or the new version, never a half written file. Readers that mmap-ed
+        # the old version keep using the old (unlinked) file.
+        temp_filename = os.path.join(
+            os.path.dirname(filename),
+            '.{}.{}{}'.format(os.path.basename(filename), secrets.token_hex(4), TEMP_FILE_SUFFIX)
+        )
+        # Not using tempfile, because it creates the file with mode 0600, and other users
+        # would not be able to read the cache (e.g. as a read-only layer). This way the
+        # permissions follow the umask, like with open().
+        fd = os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+        except BaseException:
+            os.unlink(temp_filename)
+            raise
+        os.replace(temp_filename, filename)
+
+    def delete(self, name: str) -> None:
+        self.check_writable()
+        if os.path.exists(self.get_filename(name)):
+            os.unlink(self.get_filename(name))
+
+    def size(self, name: str) -> int:
+        return os.path.getsize(self.get_filename(name))
+
+    def names_with_prefix(self, prefix: str) -> Iterable[str]:
+        for filename in glob.glob(glob.escape(self.get_filename(prefix)) + '*'):
+            yield os.path.relpath(filename, self.cache_dir)
+
+    def list_entries(self) -> Iterable[CacheEntryInfo]:
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                name = os.path.relpath(full_path, self.cache_dir)
+                if name.startswith((SQLITE_DB_FILENAME, LOCK_DIR + os.sep)):
+                    continue
+                try:
+                    stat = os.stat(full_path)
+                except FileNotFoundError:
+                    # Deleted by a concurrent process
+                    continue
+                yield CacheEntryInfo(name, stat.st_size, max(stat.st_atime, stat.st_mtime))
+
+
+class SqliteCacheBackend(CacheBackend):
+    """Stores the entries in a single SQLite database, in the cache directory.
+
+    Writes are batched into a single transaction, until flush() is called, or
+    WRITE_BATCH_SIZE writes are pending.
+    Files that are put into the cache directory directly (i.e. downloads) are
+    read from there, because they are not written with write_bytes.
+    """
+    WRITE_BATCH_SIZE = 64
+
+    def __init__(self, cache_dir: str, read_only: bool = False):
+        self.filesystem = FilesystemCacheBackend(cache_dir, read_only)
+        self.db_filename = os.path.join(cache_dir, SQLITE_DB_FILENAME)
+        self.read_only = read_only
+        self.lock = threading.RLock()
+        self.connection: Optional[sqlite3.Connection] = None
+        self.connection_pid = 0
+        self.pending_writes: Dict[str, Optional[bytes]] = {}
+        self.pending_accesses: Set[str] = set()
+        atexit.register(self.flush)
+
+    def get_connection(self) -> sqlite3.Connection:
+        # Connections cannot be shared with forked worker processes.
+        if self.connection is None or self.connection_pid != os.getpid():
+            self.connection_pid = os.getpid()
+            self.pending_writes = {}
+            self.pending_accesses = set()
+            if self.read_only:
+                uri = 'file:{}?mode=ro'.format(urllib.parse.quote(os.path.abspath(self.db_filename)))
+                if not os.access(os.path.dirname(self.db_filename) or '.', os.W_OK):
+                    # The shared memory file of WAL mode cannot be created, e.g. on a
+                    # read-only mount. Nobody can write the database there anyway.
+                    uri += '&immutable=1'
+                self.connection = sqlite3.connect(uri, uri=True, timeout=60, check_same_thread=False)
+                return self.connection
+            self.connection = sqlite3.connect(self.db_filename, timeout=60, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            with self.connection:
+                self.connection.execute('CREATE TABLE IF NOT EXISTS entries (name TEXT PRIMARY KEY, data BLOB NOT NULL)')
+                self.connection.execute(
+                    'CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)'
+                )
+        return self.connection
+
+    def read_from_db(self, name: str) -> Optional[bytes]:
+        with self.lock:
+            if name in self.pending_writes:
+                return self.pending_writes[name]
+            row = self.get_connection().execute('SELECT data FROM entries WHERE name = ?', (name, )).fetchone()
+            if row is None:
+                return None
+            # Written in batches, just like the entries.
+            if not self.read_only:
+                self.pending_accesses.add(name)
+        return bytes(row[0])
+
+    def exists(self, name: str) -> bool:
+        with self.lock:
+            if name in self.pending_writes:
+                return self.pending_writes[name] is not None
+            row = self.get_connection().execute('SELECT 1 FROM entries WHERE name = ?', (name, )).fetchone()
+        return row is not None or self.filesystem.exists(name)
+
+    def read_bytes(self, name: str) -> bytes:
+        result = self.read_from_db(name)
+        if result is None:
+            return self.filesystem.read_bytes(name)
+        return result
+
+    def read_buffer(self, name: str) -> ReadBuffer:
+        result = self.read_from_db(name)
+        if result is None:
+            return self.filesystem.read_buffer(name)
+        return result
+
+    def write_bytes(self, name: str, data: bytes) -> None:
+        self.set_pending(name, data)
+
+    def delete(self, name: str) -> None:
+        self.set_pending(name, None)
+        self.filesystem.delete(name)
+
+    def set_pending(self, name: str, data: Optional[bytes]) -> None:
+        if self.read_only:
+            raise PermissionError("Cannot modify read-only cache {}".format(self.db_filename))
+        with self.lock:
+            self.get_connection()
+            self.pending_writes[name] = data
+            if len(self.pending_writes) >= self.WRITE_BATCH_SIZE:
+                self.flush()
+
+    def size(self, name: str) -> int:
+        with self.lock:
+            if name in self.pending_writes:
+                data = self.pending_writes[name]
+                if data is None:
+                    raise FileNotFoundError(name)
+                return len(data)
+            row = self.get_connection().execute('SELECT size FROM metadata WHERE name = ?', (name, )).fetchone()
+        if row is None:
+            return self.filesystem.size(name)
+        return int(row[0])
+
+    def names_with_prefix(self, prefix: str) -> Iterable[str]:
+        escaped_prefix = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        with self.lock:
+            rows = self.get_connection().execute("SELECT name FROM entries WHERE name LIKE ? ESCAPE '\\'", (escaped_prefix + '%', )).fetchall()
+            names = {row[0] for row in rows}
+            names.update(name for name, data in self.pending_writes.items() if name.startswith(prefix) and data is not None)
+            names.difference_update(name for name, data in self.pending_writes.items() if data is None)
+        names.update(self.filesystem.names_with_prefix(prefix))
+        return sorted(names)
+
+    def list_entries(self) -> Iterable[CacheEntryInfo]:
+        self.flush()
+        with self.lock:
+            rows = self.get_connection().execute('SELECT name, size, accessed FROM metadata').fetchall()
+        yield from (CacheEntryInfo(name, size, accessed) for name, size, accessed in rows)
+        yield from self.filesystem.list_entries()
+
+    def flush(self) -> None:
+        with self.lock:
+            if not (self.pending_writes or self.pending_accesses) or self.connection_pid != os.getpid():
+                return
+            now = time.time()
+            deleted: List[Tuple[str]] = []
+            written: List[Tuple[str, bytes]] = []
+            metadata: List[Tuple[str, int, float, float]] = []
+            for name, data in self.pending_writes.items():
+                if data is None:
+                    deleted.append((name, ))
+                else:
+                    written.append((name, data))
+                    metadata.append((name, len(data), now, now))
+            connection = self.get_connection()
+            with connection:
+                connection.executemany('DELETE FROM entries WHERE name = ?', deleted)
+                connection.executemany('DELETE FROM metadata WHERE name = ?', deleted)
+                connection.executemany('INSERT OR REPLACE INTO entries (name, data) VALUES (?, ?)', written)
+                connection.executemany('INSERT OR REPLACE INTO metadata (name, size, created, accessed) VALUES (?, ?, ?, ?)', metadata)
+                connection.executemany('UPDATE metadata SET accessed = ? WHERE name = ?', ((now, name) for name in self.pending_accesses))
+            self.pending_writes = {}
+            self.pending_accesses = set()
+
+
+class LayeredCacheBackend(CacheBackend):
+    """A writable cache backend, on top of read-only ones.
+
+    Entries are read from the first layer that has them, in order: the writable
+    layer first, then the read-only ones. Writes and deletions only affect the
+    writable layer. Only the entries of the writable layer are listed, because
+    the others cannot be cleaned up anyway.
+    """
+
+    def __init__(self, writable: CacheBackend, read_only: Sequence[CacheBackend]):
+        self.writable = writable
+        self.layers = (writable, ) + tuple(read_only)
+
+    def find_layer(self, name: str) -> CacheBackend:
+        for layer in self.layers:
+            if layer.exists(name):
+                return layer
+        return self.writable
+
+    def exists(self, name: str) -> bool:
+        return any(layer.exists(name) for layer in self.layers)
+
+    def read_bytes(self, name: str) -> bytes:
+        return self.find_layer(name).read_bytes(name)
+
+    def read_buffer(self, name: str) -> ReadBuffer:
+        return self.find_layer(name).read_buffer(name)
+
+    def write_bytes(self, name: str, data: bytes) -> None:
+        self.writable.write_bytes(name, data)
+
+    def delete(self, name: str) -> None:
+        self.writable.delete(name)
+
+    def size(self, name: str) -> int:
+        return self.find_layer(name).size(name)
+
+    def names_with_prefix(self, prefix: str) -> Iterable[str]:
+        names: Set[str] = set()
+        for layer in self.layers:
+            names.update(layer.names_with_prefix(prefix))
+        return sorted(names)
+
+    def list_entries(self) -> Iterable[CacheEntryInfo]:
+        return self.writable.list_entries()
+
+    def flush(self) -> None:
+        self.writable.flush()
+
+
+def open_read_only_backend(cache_dir: str) -> CacheBackend:
+    if os.path.exists(os.path.join(cache_dir, SQLITE_DB_FILENAME)):
+        return SqliteCacheBackend(cache_dir, read_only=True)
+    return FilesystemCacheBackend(cache_dir, read_only=True)
+
+
+CACHE_BACKENDS = {
+    'filesystem': FilesystemCacheBackend,
+    'sqlite': SqliteCacheBackend,
+}
+DEFAULT_CACHE_BACKEND = 'filesystem'
+
+cache_backend: Optional[CacheBackend] = None
+
+_T = TypeVar('_T')
+
+# Rough ratio of the in-memory size of decoded objects to the size of the cache entry
+DEFAULT_DECODED_SIZE_FACTOR = 10.0
+
+
+class MemoryCache:
+    """Bounded LRU of decoded cache entries, in front of the cache backend.
+
+    Avoids decoding the same entries again and again in long running processes.
+    Entries are keyed by their names, which contain the version of the code
+    that created them. The size of the decoded objects is only estimated.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.entries: 'OrderedDict[str, Tuple[Any, int]]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, name: str) -> Tuple[bool, Any]:
+        """Returns (True, decoded object) if the entry is in the cache, (False, None) otherwise"""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            self.entries.move_to_end(name)
+            return True, entry[0]
+
+    def put(self, name: str, decoded: Any, size: int) -> None:
+        with self.lock:
+            self.discard_unlocked(name)
+            if size > self.max_size:
+                return
+            self.entries[name] = (decoded, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def discard(self, name: str) -> None:
+        with self.lock:
+            self.discard_unlocked(name)
+
+    def discard_unlocked(self, name: str) -> None:
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def report(self) -> str:
+        return "Memory cache: {} hits, {} misses, {} evictions, {} entries, ~{} MiB".format(
+            self.hits, self.misses, self.evictions, len(self.entries), self.size // (1024 * 1024)
+        )
+
+
+memory_cache: Optional[MemoryCache] = None
+
+
+def set_memory_cache_size(max_size: int) -> None:
+    """Sets the estimated maximum size of the in-memory cache of decoded entries in bytes. 0 disables it."""
+    global memory_cache
+    memory_cache = MemoryCache(max_size) if max_size > 0 else None
 
 
 class CacheObject:
     def __init__(self, name: str):
-        if cache_dir_path is None:
+        if cache_dir_path is None or cache_backend is None:
             raise RuntimeError("Cache not initialized yet")
+        self.name: str = name
         self.filename: str = os.path.join(cache_dir_path, name)
+        self.backend: CacheBackend = cache_backend
+        # For the metrics. Entries not created by a CacheStage are downloads, or their metadata.
+        parsed_key = ParsedCacheKey.from_name(name)
+        self.stage: str = 'source' if parsed_key is None else parsed_key.stage
 
     def exists(self) -> bool:
-        return os.path.exists(self.filename)
+        return self.backend.exists(self.name)
 
     def write_bytes(self, data: bytes) -> None:
-        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
-        with open(self.filename, 'wb') as f:
-            f.write(data)
+        if memory_cache is not None:
+            memory_cache.discard(self.name)
+        self.backend.write_bytes(self.name, data)
+        update_metrics(self.stage, bytes_written=len(data))
+
+    def read_bytes(self) -> bytes:
+        result = self.backend.read_bytes(self.name)
+        update_metrics(self.stage, bytes_read=len(result))
+        return result
+
+    def mmap(self) -> ReadBuffer:
+        """Contents of the cache entry, without reading everything (if the backend supports it)"""
+        result = self.backend.read_buffer(self.name)
+        # Not necessarily read, but mapped at least.
+        update_metrics(self.stage, bytes_read=len(result))
+        return result
 
     def read_json(self) -> Any:
-        with gzip.open(self.filename, 'rt') as f:
-            return json.load(f)
+        return json.loads(gzip.decompress(self.read_bytes()).decode('utf-8'))
 
     def write_json(self, data: Any) -> None:
-        with gzip.open(self.filename, 'wt') as f:
-            json.dump(data, f, separators=(',', ':'))
+        self.write_bytes(gzip.compress(json.dumps(data, separators=(',', ':')).encode('utf-8')))
+
+    def delete(self) -> None:
+        if memory_cache is not None:
+            memory_cache.discard(self.name)
+        self.backend.delete(self.name)
+
+    def read_decoded(self, decode: Callable[['CacheObject'], _T], size_factor: float = DEFAULT_DECODED_SIZE_FACTOR) -> _T:
+        """Reads the entry with the decode function, or returns it from the memory cache, if it is enabled.
+
+        The decoded object is shared between the callers, so it must not be modified.
+        """
+        if memory_cache is not None:
+            found, cached = memory_cache.get(self.name)
+            if found:
+                update_metrics(self.stage, memory_hits=1)
+                return cast(_T, cached)
+        with measure_time(self.stage, 'decode_time'):
+            result = decode(self)
+        self.remember_decoded(result, size_factor)
+        return result
+
+    def remember_decoded(self, decoded: Any, size_factor: float = DEFAULT_DECODED_SIZE_FACTOR) -> None:
+        """Puts the already written entry into the memory cache in decoded form, if it is enabled."""
+        if memory_cache is not None:
+            memory_cache.put(self.name, decoded, int(self.backend.size(self.name) * size_factor))
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        """Exclusive advisory lock of the entry, shared by every process using the cache directory.
+
+        Used when computing entries: the others wait for the result, instead of computing it again.
+        Entries should be checked again after acquiring the lock. Writes are flushed before unlocking.
+        """
+        if fcntl is None:
+            yield
+            self.backend.flush()
+            return
+        assert cache_dir_path is not None
+        lock_filename = os.path.join(cache_dir_path, LOCK_DIR, self.name + '.lock')
+        os.makedirs(os.path.dirname(lock_filename), exist_ok=True)
+        # The lock file holds no data, it is only opened for flock()
+        fd = os.open(lock_filename, os.O_CREAT | os.O_RDWR, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+                self.backend.flush()
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def sidecar(self, suffix: str) -> 'CacheObject':
+        """Returns the cache object storing metadata about this one"""
+        return CacheObject(self.name + suffix)
+
+    def derived_objects(self) -> List['CacheObject']:
+        """Returns the cache objects with the name of this one plus a suffix, e.g. MK/2013/31.pdf.parsed.bin for MK/2013/31.pdf"""
+        return [CacheObject(name) for name in self.backend.names_with_prefix(self.name + '.')]
+
+    def write_file(self, data: bytes) -> None:
+        """Writes the entry to get_writable_filename() atomically, regardless of the backend.
+
+        For entries that are normally not written with write_bytes, e.g. downloads.
+        """
+        assert cache_dir_path is not None
+        FilesystemCacheBackend(cache_dir_path).write_bytes(self.name, data)
+        update_metrics(self.stage, bytes_written=len(data))
 
     def get_filename(self) -> str:
+        """Filename of the cache entry, for files that are not written with write_bytes.
+
+        E.g. downloaded files, that are written to gradually. If the file is
+        in a read-only cache layer, its filename there is returned.
+        """
+        if read_only_cache_dir_paths and not os.path.exists(self.filename):
+            for cache_dir in read_only_cache_dir_paths:
+                filename = os.path.join(cache_dir, self.name)
+                if os.path.exists(filename):
+                    return filename
+        return self.filename
+
+    def get_writable_filename(self) -> str:
+        """Filename of the cache entry in the writable cache layer, for writing files directly."""
         return self.filename
 
     def size_on_disk(self) -> int:
         if not self.exists():
             return 0
-        return os.path.getsize(self.filename)
+        return self.backend.size(self.name)
+
+
+def list_cache_entries() -> List[CacheEntryInfo]:
+    if cache_backend is None:
+        raise RuntimeError("Cache not initialized yet")
+    return list(cache_backend.list_entries())
+
+
+def is_cache_initialized() -> bool:
+    return cache_dir_path is not None
+
+
+def flush_cache() -> None:
+    if cache_backend is not None:
+        cache_backend.flush()
+
+
+def get_default_cache_dirs(default_cache_dir: str) -> Tuple[str, List[str]]:
+    """Returns the writable cache directory and the read-only ones, based on the environment variables.
+
+    HUN_LAW_CACHE_DIR is the writable cache, HUN_LAW_READ_ONLY_CACHE_DIRS is a list
+    of read-only (e.g. shared) caches, separated by os.pathsep (':' on Unix).
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV_VAR) or default_cache_dir
+    read_only_cache_dirs = [d for d in os.environ.get(READ_ONLY_CACHE_DIRS_ENV_VAR, '').split(os.pathsep) if d]
+    return cache_dir, read_only_cache_dirs
 
 
-def init_cache(cache_dir: str) -> None:
+def init_cache(cache_dir: str, backend: str = DEFAULT_CACHE_BACKEND, read_only_cache_dirs: Sequence[str] = ()) -> None:
+    """Sets up the cache. New entries are written to cache_dir, and if they are not found there,
+    they are looked up in the read_only_cache_dirs, in order."""
     global cache_dir_path
+    global read_only_cache_dir_paths
+    global cache_backend
+    if cache_backend is not None:
+        cache_backend.flush()
     cache_dir_path = cache_dir
+    read_only_cache_dir_paths = tuple(read_only_cache_dirs)
     os.makedirs(cache_dir, exist_ok=True)
+    cache_backend = CACHE_BACKENDS[backend](cache_dir)
+    if read_only_cache_dirs:
+        cache_backend = LayeredCacheBackend(cache_backend, [open_read_only_backend(d) for d in read_only_cache_dirs])
@@ -0,0 +1,191 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+
+# Export and import of cache entries, for seeding the cache of other machines.
+#
+# A bundle is a gzipped tar file. Its first member is MANIFEST.json, describing
+# the entries, which are stored with their cache entry names.
+
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import tarfile
+import time
+from typing import Any, Collection, Dict, List, Optional
+
+import attr
+
+from hun_law.cache import CacheEntryInfo, CacheObject, list_cache_entries, flush_cache
+from hun_law.cache_keys import ParsedCacheKey
+from hun_law.cache_maintenance import get_stage_of_entry, is_stale_entry, is_temporary_entry
+from hun_law.downloader import MANIFEST_SUFFIX
+
+BUNDLE_MANIFEST_NAME = 'MANIFEST.json'
+BUNDLE_FORMAT_VERSION = 1
+
+# E.g. MK/2013/31.pdf.parsed.0123456789abcdef.0123456789abcdef.bin or acts/2013. évi V. törvény.act.[...].gz
+YEAR_RE = re.compile(r'^(?:MK/(\d{4})/|acts/(\d{4})\.)')
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class EntrySelector:
+    """Selects cache entries for export. None means no filtering"""
+    stages: Optional[Collection[str]] = None
+    years: Optional[Collection[int]] = None
+    fingerprints: Optional[Collection[str]] = None
+
+    def matches(self, name: str) -> bool:
+        stages = self.stages
+        if stages is not None:
+            if get_stage_of_entry(name) not in stages:
+                return False
+        years = self.years
+        if years is not None:
+            if get_year_of_entry(name) not in years:
+                return False
+        fingerprints = self.fingerprints
+        if fingerprints is not None:
+            parsed_key = ParsedCacheKey.from_name(name)
+            if parsed_key is None or parsed_key.fingerprint not in fingerprints:
+                return False
+        return True
+
+
+@attr.s(slots=True, auto_attribs=True)
+class ImportResult:
+    imported: int = 0
+    already_present: int = 0
+    incompatible: int = 0
+    corrupt: int = 0
+
+
+def get_year_of_entry(name: str) -> Optional[int]:
+    match = YEAR_RE.match(name)
+    if match is None:
+        return None
+    return int(match.group(1) or match.group(2))
+
+
+def is_safe_entry_name(name: str) -> bool:
+    """Entry names of bundles must not point outside of the cache directory"""
+    return not os.path.isabs(name) and '..' not in name.split('/') and '\\' not in name
+
+
+def is_downloaded_file(name: str) -> bool:
+    """Downloads are stored as files, even if the backend is not the filesystem"""
+    return get_stage_of_entry(name) == 'source' and not name.endswith(MANIFEST_SUFFIX)
+
+
+def select_entries_for_export(selector: EntrySelector) -> List[CacheEntryInfo]:
+    entries = list_cache_entries()
+    all_names = {entry.name for entry in entries}
+    result = []
+    for entry in entries:
+        if is_temporary_entry(entry.name) or is_stale_entry(entry.name, all_names):
+            continue
+        if selector.matches(entry.name):
+            result.append(entry)
+    return sorted(result, key=lambda entry: entry.name)
+
+
+def add_file_to_tar(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    tar_info = tarfile.TarInfo(name)
+    tar_info.size = len(data)
+    tar_info.mtime = int(time.time())
+    tar.addfile(tar_info, io.BytesIO(data))
+
+
+def export_bundle(output_filename: str, selector: EntrySelector) -> int:
+    """Writes the selected entries into a bundle file. Returns the number of exported entries."""
+    entries = select_entries_for_export(selector)
+    manifest_entries: List[Dict[str, Any]] = []
+    with tarfile.open(output_filename, 'w:gz') as tar:
+        # The manifest has to be the first member, but the hashes are only known after reading the
+        # entries, so they are read twice. Cache entries are not that big, and this is rarely done.
+        for entry in entries:
+            data = CacheObject(entry.name).read_bytes()
+            manifest_entries.append({
+                'name': entry.name,
+                'stage': get_stage_of_entry(entry.name),
+                'size': len(data),
+                'sha256': hashlib.sha256(data).hexdigest(),
+            })
+        manifest = {
+            'format_version': BUNDLE_FORMAT_VERSION,
+            'created': time.time(),
+            'entries': manifest_entries,
+        }
+        add_file_to_tar(tar, BUNDLE_MANIFEST_NAME, json.dumps(manifest, indent='  ', ensure_ascii=False).encode('utf-8'))
+        for entry in entries:
+            add_file_to_tar(tar, entry.name, CacheObject(entry.name).read_bytes())
+    return len(entries)
+
+
+def is_compatible_entry(name: str) -> bool:
+    """Entries created by a different version of the code than the current one are incompatible.
+
+    Entries not created by a stage (i.e. downloads) are always compatible.
+    """
+    parsed_key = ParsedCacheKey.from_name(name)
+    return parsed_key is None or parsed_key.is_current()
+
+
+def import_bundle(input_filename: str) -> ImportResult:
+    """Imports the compatible entries of a bundle into the cache. Existing entries are kept."""
+    result = ImportResult()
+    with tarfile.open(input_filename, 'r:gz') as tar:
+        manifest_member = tar.next()
+        if manifest_member is None or manifest_member.name != BUNDLE_MANIFEST_NAME:
+            raise ValueError("{} is not a cache bundle: it has no manifest".format(input_filename))
+        manifest_file = tar.extractfile(manifest_member)
+        assert manifest_file is not None
+        manifest = json.load(manifest_file)
+        if manifest['format_version'] != BUNDLE_FORMAT_VERSION:
+            raise ValueError("Unsupported cache bundle format version: {}".format(manifest['format_version']))
+        expected_hashes = {entry['name']: entry['sha256'] for entry in manifest['entries']}
+        for member in tar:
+            if member is manifest_member:
+                continue
+            name = member.name
+            if name not in expected_hashes or not member.isfile() or not is_safe_entry_name(name):
+                print("Skipping {}: not a valid entry of the manifest".format(name), file=sys.stderr)
+                result.corrupt += 1
+                continue
+            if not is_compatible_entry(name):
+                result.incompatible += 1
+                continue
+            cache_object = CacheObject(name)
+            if cache_object.exists():
+                result.already_present += 1
+                continue
+            member_file = tar.extractfile(member)
+            assert member_file is not None
+            data = member_file.read()
+            if hashlib.sha256(data).hexdigest() != expected_hashes[name]:
+                print("Skipping {}: hash mismatch".format(name), file=sys.stderr)
+                result.corrupt += 1
+                continue
+            if is_downloaded_file(name):
+                cache_object.write_file(data)
+            else:
+                cache_object.write_bytes(data)
+            result.imported += 1
+    flush_cache()
+    return result
@@ -0,0 +1,179 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+
+# Cache keys for the results of processing stages. A key consists of a stage
+# name, a fingerprint of the code of the stage, and a hash of the input, so an
+# entry computed by a different version of the code is never used, and there is
+# no version number to bump by hand.
+#
+# Example: for the input "MK/2013/31.pdf", the key of the PDF parsing stage
+# is "MK/2013/31.pdf.parsed.<stage fingerprint>.<input hash>"
+
+import hashlib
+import importlib
+import os
+import re
+import types
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import attr
+
+# Number of hex digits of the hashes used in cache keys
+KEY_HASH_LENGTH = 16
+
+CACHE_KEY_RE = re.compile(
+    r'^(?P<input_id>.+)\.(?P<stage>\w+)\.(?P<fingerprint>[0-9a-f]{{{n}}})\.(?P<input_hash>[0-9a-f]{{{n}}})(?P<suffix>\.[^./]+)?$'.format(n=KEY_HASH_LENGTH)
+)
+
+_file_hashes: Dict[Tuple[str, int, int], str] = {}
+_stage_fingerprints: Dict[str, str] = {}
+
+all_cache_stages: Dict[str, 'CacheStage'] = {}
+
+
+def hash_strings(*parts: str) -> str:
+    result = hashlib.sha256()
+    for part in parts:
+        encoded = part.encode('utf-8')
+        # Length prefix, so that ('ab', 'c') and ('a', 'bc') are different
+        result.update(len(encoded).to_bytes(8, 'little'))
+        result.update(encoded)
+    return result.hexdigest()
+
+
+def hash_file(filename: str) -> str:
+    """SHA-256 of the contents of a file. Memoized, until the file is modified."""
+    stat = os.stat(filename)
+    memo_key = (filename, stat.st_mtime_ns, stat.st_size)
+    result = _file_hashes.get(memo_key)
+    if result is None:
+        sha256 = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        result = sha256.hexdigest()
+        _file_hashes[memo_key] = result
+    return result
+
+
+def hash_modules(*module_names: str) -> str:
+    """Fingerprint of the source code of python modules"""
+    hashes = []
+    for module_name in module_names:
+        module = importlib.import_module(module_name)
+        assert module.__file__ is not None
+        hashes.append(module_name)
+        hashes.append(hash_file(module.__file__))
+    return hash_strings(*hashes)
+
+
+def _hash_value(value: Any) -> str:
+    """Stable hash of a constant, or a value closed over.
+
+    repr() is not enough for everything: nested code objects (e.g. comprehensions)
+    contain their memory address, and the order of sets depends on the hash seed
+    of the process.
+    """
+    if isinstance(value, types.CodeType):
+        return _hash_code(value)
+    if isinstance(value, (set, frozenset)):
+        return hash_strings(type(value).__name__, *sorted(_hash_value(v) for v in value))
+    if isinstance(value, tuple):
+        return hash_strings('tuple', *(_hash_value(v) for v in value))
+    return hash_strings(repr(value))
+
+
+def _hash_code(code: types.CodeType) -> str:
+    return hash_strings(
+        code.co_code.hex(),
+        hash_strings(*(_hash_value(c) for c in code.co_consts)),
+        hash_strings(*code.co_names),
+    )
+
+
+def hash_function(fn: Callable) -> str:
+    """Fingerprint of a function, including the values it closes over.
+
+    Functions that are called by fn are not included, those should be
+    covered by hash_modules(). The result is the same in every process.
+    """
+    parts = [fn.__module__, fn.__qualname__, _hash_code(fn.__code__)]
+    for cell in fn.__closure__ or ():
+        contents = cell.cell_contents
+        if callable(contents) and hasattr(contents, '__code__'):
+            parts.append(hash_function(contents))
+        else:
+            parts.append(_hash_value(contents))
+    return hash_strings(*parts)
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class CacheStage:
+    name: str
+    # Modules whose source code determines the result of the stage
+    modules: Tuple[str, ...]
+    # Callables returning additional version information, e.g. versions
+    # of dependencies, or hashes of data files. Called lazily.
+    extra_versions: Tuple[Callable[[], str], ...] = ()
+
+    def __attrs_post_init__(self) -> None:
+        all_cache_stages[self.name] = self
+
+    def fingerprint(self) -> str:
+        result = _stage_fingerprints.get(self.name)
+        if result is None:
+            result = hash_strings(self.name, hash_modules(*self.modules), *(v() for v in self.extra_versions))
+            _stage_fingerprints[self.name] = result
+        return result
+
+    def cache_key(self, input_id: str, input_hash: str, *extra_inputs: Any) -> str:
+        """Key of the result of this stage for an input.
+
+        input_id is a human readable identifier of the input (e.g. the cache id of
+        the original PDF), input_hash is the hash of its contents. Extra inputs
+        are anything else that influences the result, like the fixups of an Act.
+        """
+        return "{}.{}.{}.{}".format(
+            input_id,
+            self.name,
+            self.fingerprint()[:KEY_HASH_LENGTH],
+            hash_strings(input_hash, *(str(e) for e in extra_inputs))[:KEY_HASH_LENGTH],
+        )
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class ParsedCacheKey:
+    input_id: str
+    stage: str
+    fingerprint: str
+    input_hash: str
+
+    @classmethod
+    def from_name(cls, name: str) -> Optional['ParsedCacheKey']:
+        """Parses the name of a cache entry. Returns None if it was not created with a CacheStage key"""
+        match = CACHE_KEY_RE.match(name)
+        if match is None:
+            return None
+        return cls(match['input_id'], match['stage'], match['fingerprint'], match['input_hash'])
+
+    def is_current(self) -> bool:
+        """Returns False if the stage does not exist anymore, or its code changed since the key was created.
+
+        Only the stages that are already imported are known.
+        """
+        stage = all_cache_stages.get(self.stage)
+        return stage is not None and stage.fingerprint()[:KEY_HASH_LENGTH] == self.fingerprint
@@ -0,0 +1,167 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+
+# Accounting, size limiting and garbage collection of the cache.
+#
+# Entries created with CacheStage keys are "derived": they can always be
+# recomputed from the downloaded files, so they are evicted first.
+
+import os
+import re
+import sys
+import time
+from typing import Dict, Iterable, List, Optional
+
+import attr
+
+from hun_law.cache import CacheEntryInfo, CacheObject, list_cache_entries, flush_cache, TEMP_FILE_SUFFIX
+from hun_law.cache_keys import ParsedCacheKey
+from hun_law.downloader import MANIFEST_SUFFIX
+
+# Entries from before the cache keys had code fingerprints, e.g. MK/2013/31.pdf.parsed_v5.gz
+LEGACY_ENTRY_RE = re.compile(r'\.parsed_v\d+\.(gz|bin)$')
+
+# Temporary files older than this were left behind by crashed processes
+TEMP_FILE_MAX_AGE = 24 * 3600
+
+SIZE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+@attr.s(slots=True, auto_attribs=True)
+class StageStats:
+    count: int = 0
+    size: int = 0
+    last_accessed: float = 0
+
+
+def is_temporary_entry(name: str) -> bool:
+    return os.path.basename(name).startswith('.') and name.endswith(TEMP_FILE_SUFFIX)
+
+
+def get_stage_of_entry(name: str) -> str:
+    """Name of the stage that created the entry, or 'source' for downloaded files"""
+    if is_temporary_entry(name):
+        return 'temporary'
+    parsed_key = ParsedCacheKey.from_name(name)
+    if parsed_key is not None:
+        return parsed_key.stage
+    if name.endswith(MANIFEST_SUFFIX):
+        return 'manifest'
+    if LEGACY_ENTRY_RE.search(name):
+        return 'legacy'
+    return 'source'
+
+
+def is_derived_entry(name: str) -> bool:
+    return get_stage_of_entry(name) not in ('source', 'manifest')
+
+
+def is_stale_entry(name: str, all_names: Iterable[str]) -> bool:
+    """Returns True for entries that will never be used again by the current code.
+
+    all_names should contain every entry name, for detecting orphan manifests.
+    """
+    parsed_key = ParsedCacheKey.from_name(name)
+    if parsed_key is not None:
+        return not parsed_key.is_current()
+    if name.endswith(MANIFEST_SUFFIX):
+        return name[:-len(MANIFEST_SUFFIX)] not in all_names
+    return LEGACY_ENTRY_RE.search(name) is not None
+
+
+def get_cache_stats(entries: Optional[Iterable[CacheEntryInfo]] = None) -> Dict[str, StageStats]:
+    if entries is None:
+        entries = list_cache_entries()
+    result: Dict[str, StageStats] = {}
+    for entry in entries:
+        stats = result.setdefault(get_stage_of_entry(entry.name), StageStats())
+        stats.count += 1
+        stats.size += entry.size
+        stats.last_accessed = max(stats.last_accessed, entry.accessed)
+    return result
+
+
+def remove_entries(entries: Iterable[CacheEntryInfo], dry_run: bool = False) -> List[CacheEntryInfo]:
+    result = []
+    for entry in entries:
+        print("{} cache entry {}".format("Would remove" if dry_run else "Removing", entry.name), file=sys.stderr)
+        if not dry_run:
+            CacheObject(entry.name).delete()
+        result.append(entry)
+    flush_cache()
+    return result
+
+
+def collect_garbage(dry_run: bool = False) -> List[CacheEntryInfo]:
+    """Removes the entries created by older versions of the code. Returns the removed entries.
+
+    The stages are only known if their modules are imported.
+    """
+    entries = list_cache_entries()
+    all_names = {entry.name for entry in entries}
+    temp_file_limit = time.time() - TEMP_FILE_MAX_AGE
+    return remove_entries(
+        (
+            entry for entry in entries
+            if is_stale_entry(entry.name, all_names) or (is_temporary_entry(entry.name) and entry.accessed < temp_file_limit)
+        ),
+        dry_run
+    )
+
+
+def evict_to_size(max_size: int, dry_run: bool = False) -> List[CacheEntryInfo]:
+    """Removes the least recently used entries, until the cache is smaller than max_size.
+
+    Derived entries are removed first, and downloaded files only if that is not enough.
+    Manifests are removed together with their files.
+    """
+    entries = list_cache_entries()
+    total_size = sum(entry.size for entry in entries)
+    if total_size <= max_size:
+        return []
+    manifests = {entry.name: entry for entry in entries if entry.name.endswith(MANIFEST_SUFFIX)}
+    # Temporary files may be in use, and they are small anyway.
+    candidates = sorted(
+        (entry for entry in entries if entry.name not in manifests and not is_temporary_entry(entry.name)),
+        key=lambda entry: (not is_derived_entry(entry.name), entry.accessed)
+    )
+    to_remove = []
+    for entry in candidates:
+        if total_size <= max_size:
+            break
+        to_remove.append(entry)
+        total_size -= entry.size
+        manifest = manifests.get(entry.name + MANIFEST_SUFFIX)
+        if manifest is not None:
+            to_remove.append(manifest)
+            total_size -= manifest.size
+    return remove_entries(to_remove, dry_run)
+
+
+def parse_size(s: str) -> int:
+    """Parses sizes like '500M' or '20G'"""
+    s = s.strip().upper().rstrip('B')
+    suffix = s[-1:] if s[-1:] in SIZE_SUFFIXES else ''
+    return int(float(s[:len(s) - len(suffix)]) * SIZE_SUFFIXES[suffix])
+
+
+def format_size(size: float) -> str:
+    for suffix in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return "{:.1f} {}".format(size, suffix)
+        size /= 1024
+    return "{:.1f} TiB".format(size)
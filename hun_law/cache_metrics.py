@@ -0,0 +1,120 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+
+# Per-stage statistics of cache usage: hits, misses, I/O and the time spent on
+# decoding cached results and on computing missing ones.
+#
+# Worker processes collect their own metrics, which are sent back to the main
+# process with the results (see extractors/all.py)
+
+import contextlib
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, TextIO
+
+import attr
+
+
+@attr.s(slots=True, auto_attribs=True)
+class StageMetrics:
+    hits: int = 0
+    misses: int = 0
+    # Hits that were served from the memory cache, without reading the entry
+    memory_hits: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    # Seconds spent reading and decoding cached entries
+    decode_time: float = 0.0
+    # Seconds spent computing missing entries
+    compute_time: float = 0.0
+    # Only used by the PDF parsing stage: effectiveness of the glyph decoding cache,
+    # and memory saved by sharing identical parts of lines (see IndentedLinePartInterner)
+    glyph_cache_hits: int = 0
+    glyph_cache_misses: int = 0
+    interned_parts: int = 0
+    interner_saved_bytes: int = 0
+
+    @property
+    def compute_time_saved(self) -> float:
+        """Estimated seconds saved by the cache hits, based on the average compute time of the misses"""
+        if not self.misses:
+            return 0.0
+        return self.hits * self.compute_time / self.misses - self.decode_time
+
+    def merge(self, other: 'StageMetrics') -> None:
+        for field in attr.fields(StageMetrics):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = attr.asdict(self)
+        result['compute_time_saved'] = self.compute_time_saved
+        return result
+
+
+_metrics: Dict[str, StageMetrics] = {}
+_metrics_lock = threading.Lock()
+
+
+def update_metrics(stage: str, **increments: Any) -> None:
+    """Increments the fields of the metrics of a stage, e.g. update_metrics('parsed', hits=1)"""
+    with _metrics_lock:
+        metrics = _metrics.setdefault(stage, StageMetrics())
+        for name, value in increments.items():
+            setattr(metrics, name, getattr(metrics, name) + value)
+
+
+@contextlib.contextmanager
+def measure_time(stage: str, field: str) -> Iterator[None]:
+    """Adds the time spent in the with block to a time field of the metrics of a stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        update_metrics(stage, **{field: time.perf_counter() - start})
+
+
+def get_metrics() -> Dict[str, StageMetrics]:
+    """Returns a copy of the metrics collected so far in this process, by stage name"""
+    with _metrics_lock:
+        return {stage: attr.evolve(metrics) for stage, metrics in _metrics.items()}
+
+
+def take_metrics() -> Dict[str, StageMetrics]:
+    """Returns the metrics collected so far, and resets them"""
+    global _metrics
+    with _metrics_lock:
+        result = _metrics
+        _metrics = {}
+    return result
+
+
+def merge_metrics(metrics: Dict[str, StageMetrics]) -> None:
+    """Adds metrics collected by another process"""
+    with _metrics_lock:
+        for stage, stage_metrics in metrics.items():
+            _metrics.setdefault(stage, StageMetrics()).merge(stage_metrics)
+
+
+def reset_metrics() -> None:
+    take_metrics()
+
+
+def write_metrics_report(output_file: TextIO) -> None:
+    report = {stage: metrics.to_dict() for stage, metrics in sorted(get_metrics().items())}
+    json.dump(report, output_file, indent='  ')
+    output_file.write('\n')
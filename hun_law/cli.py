@@ -18,22 +18,59 @@
 import argparse
 import sys
 import os
-from typing import Sequence, TextIO, Union
+import time
+from typing import Iterable, List, Optional, Sequence, TextIO, Union
 
 from hun_law.extractors.act import BlockAmendmentOnlyAct, StructureOnlyAct
-from hun_law.extractors.kozlonyok_hu_downloader import KozlonyToDownload
-from hun_law.extractors.magyar_kozlony import MagyarKozlonyLawRawText
+from hun_law.extractors.kozlonyok_hu_downloader import KozlonyToDownload, set_base_url, revalidate_issues, DEFAULT_BASE_URL
+from hun_law.extractors.magyar_kozlony import MagyarKozlonyLawRawText, ActIdentifierFilter
 from hun_law.extractors.all import do_extraction
+from hun_law.extractors.pdf import set_page_workers, set_cache_format, CACHE_FORMATS
 from hun_law.output.json import serialize_to_json_file
 from hun_law.output.txt import write_txt
 from hun_law.output.html import generate_html_for_act
 from hun_law.structure import Act
-from hun_law.cache import init_cache
+from hun_law import cache
+from hun_law.cache import init_cache, get_default_cache_dirs, set_memory_cache_size, CACHE_BACKENDS, DEFAULT_CACHE_BACKEND
+from hun_law.cache_metrics import write_metrics_report
+from hun_law.cache_bundle import EntrySelector, export_bundle, import_bundle
+from hun_law.cache_maintenance import collect_garbage, evict_to_size, get_cache_stats, parse_size, format_size
+from hun_law.act_to_mk_issue import load_act_to_mk_issue, select_issues, find_issue_of_act
+from hun_law.downloader import set_download_workers
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'cache')
+
+
+def add_cache_arguments(argparser: argparse.ArgumentParser) -> None:
+    default_cache_dir, default_read_only_cache_dirs = get_default_cache_dirs(DEFAULT_CACHE_DIR)
+    argparser.add_argument(
+        '--cache-dir', default=default_cache_dir,
+        help="Directory of the cache. New cache entries are written here. "
+        "Defaults to the HUN_LAW_CACHE_DIR environment variable, or the 'cache' directory of the repository."
+    )
+    argparser.add_argument(
+        '--read-only-cache-dir', action='append', default=default_read_only_cache_dirs, dest='read_only_cache_dirs',
+        help="A read-only (e.g. shared) cache directory. Entries not found in the cache directory are looked up here. "
+        "Can be specified multiple times, the directories are searched in order, after the ones in the "
+        "HUN_LAW_READ_ONLY_CACHE_DIRS environment variable (separated by '{}').".format(os.pathsep)
+    )
+    argparser.add_argument(
+        '--cache-backend', choices=CACHE_BACKENDS.keys(), default=DEFAULT_CACHE_BACKEND,
+        help="Where to store the cache entries: in separate files, or in a single SQLite database. "
+        "Downloaded issues are always stored as files."
+    )
+
+
+def init_cache_from_args(parsed_args: argparse.Namespace) -> None:
+    init_cache(parsed_args.cache_dir, parsed_args.cache_backend, parsed_args.read_only_cache_dirs)
+
 
 GENERATOR_DESCRIPTION = """
 Hun-Law output generator.
 
 Downloads Magyar Közlöny issues as PDFs and converts the Acts in them to machine-parseable formats.
+Use 'gc' as the first argument to clean up the cache instead, or 'export-cache'
+and 'import-cache' to copy the cache to another machine.
 """
 
 
@@ -59,9 +96,27 @@ class GenerateCommand:
             return KozlonyToDownload(int(year), int(act))
 
         self.argparser.add_argument(
-            'issues', nargs='+', metavar='issue', type=issue,
+            'issues', nargs='*', metavar='issue', type=issue,
             help="The  Magyar Közlöny issue to download in YEAR/ISSUE format. Example: '2013/31'"
         )
+        self.argparser.add_argument(
+            '--all-acts', action='store_true',
+            help="Process every issue that contains an Act, according to act_to_mk_issue.csv. "
+            "Can be narrowed down with --from-year, --to-year and --act. Biggest issues are processed first."
+        )
+        self.argparser.add_argument(
+            '--from-year', type=int, default=None,
+            help="Only process Acts from this year or later, when using --all-acts."
+        )
+        self.argparser.add_argument(
+            '--to-year', type=int, default=None,
+            help="Only process Acts from this year or earlier, when using --all-acts."
+        )
+        self.argparser.add_argument(
+            '--act', action='append', default=None, dest='acts',
+            help="Only process the issue of this Act, when using --all-acts. Can be specified multiple times. "
+            "Example: '2013. évi V. törvény'"
+        )
         self.argparser.add_argument(
             '--output-dir', '-o',
             default=None,
@@ -69,9 +124,9 @@ class GenerateCommand:
         )
         self.argparser.add_argument(
             '--single-act', '-s', default=None,
-            help="Extract only a single Act from the MK issue. "
+            help="Extract only a single Act from the MK issue. The other Acts are not parsed at all. "
             "Useful for printing single documents to stdout. "
-            "Only supported with full parses. "
+            "If no issues are specified, the issue of the Act is looked up in act_to_mk_issue.csv. "
             "Example: '2013. évi V. törvény'"
         )
         self.argparser.add_argument(
@@ -82,30 +137,114 @@ class GenerateCommand:
         self.argparser.add_argument(
             '--workers', '-j', default=1,
             type=int,
-            help="Worker processes to use for extraction. One worker works on a whole issue at once. 1 means single process mode."
+            help="Worker processes to use for extraction. The PDF of an issue is parsed by a single worker, but its Acts are parsed "
+            "as separate tasks, the longest ones first. 1 means single process mode."
+        )
+        self.argparser.add_argument(
+            '--only-law-pages', action='store_true',
+            help="Use the table of contents of the issues to only parse the pages of the Acts, skipping everything else."
+        )
+        self.argparser.add_argument(
+            '--pdf-cache-format', default='binary', choices=CACHE_FORMATS,
+            help="Format of the cache files of parsed PDFs. The binary format is way faster to load, "
+            "the gzipped JSON format is human readable."
+        )
+        self.argparser.add_argument(
+            '--page-workers', default=1,
+            type=int,
+            help="Worker processes to use for parsing the pages of a single PDF. "
+            "Only used in single process mode (--workers 1), worker processes parse their PDFs alone. 1 means single process mode."
+        )
+        self.argparser.add_argument(
+            '--download-workers', default=4,
+            type=int,
+            help="Number of issues to download concurrently in the background, while the previous ones are processed. "
+            "0 means downloading every issue right before processing it."
+        )
+        self.argparser.add_argument(
+            '--download-base-url', default=DEFAULT_BASE_URL,
+            help="URL to download Magyar Közlöny issues from. Can also be a local directory with files named like MK13031.pdf."
+        )
+        self.argparser.add_argument(
+            '--revalidate', action='store_true',
+            help="Check if the already downloaded issues changed on the server, and re-download and re-parse them if so."
+        )
+        add_cache_arguments(self.argparser)
+        self.argparser.add_argument(
+            '--memory-cache-size', type=parse_size, default=None,
+            help="Keep this much of the decoded cache entries in memory (per process), so that they are not decoded again "
+            "when they are used multiple times. Example: '2G'"
+        )
+        self.argparser.add_argument(
+            '--metrics-report', default=None,
+            help="Write the cache metrics (hits, misses, I/O, decoding and computing time per stage) "
+            "as JSON to this file at the end of the run, instead of printing them to stderr."
+        )
+        self.argparser.add_argument(
+            '--max-cache-size', type=parse_size, default=None,
+            help="After processing, remove the least recently used cache entries until the cache is smaller than this. "
+            "Parsed documents are removed before downloaded ones. Example: '20G'"
         )
 
-    def run(self, argv: Sequence[str]) -> None:
-        init_cache(os.path.join(os.path.dirname(__file__), '..', 'cache'))
-        parsed_args = self.argparser.parse_args(argv)
+    def _configure_from_args(self, parsed_args: argparse.Namespace) -> None:
+        """Sets up the cache, the workers and the downloader, and resolves the issues to process"""
+        init_cache_from_args(parsed_args)
+        if parsed_args.memory_cache_size is not None:
+            set_memory_cache_size(parsed_args.memory_cache_size)
+        if parsed_args.all_acts:
+            parsed_args.issues.extend(self.issues_from_act_list(parsed_args.from_year, parsed_args.to_year, parsed_args.acts))
+        if not parsed_args.issues and parsed_args.single_act is not None:
+            issue_of_act = find_issue_of_act(parsed_args.single_act)
+            if issue_of_act is None:
+                self.argparser.error("Could not find the issue of {} in act_to_mk_issue.csv".format(parsed_args.single_act))
+            parsed_args.issues.append(KozlonyToDownload(*issue_of_act))
+        if not parsed_args.issues:
+            self.argparser.error("No issues to process. Specify them explicitly, or use --all-acts")
+        parsed_args.issues = self.deduplicate_issues(parsed_args.issues)
         if parsed_args.output_dir is not None:
             os.makedirs(parsed_args.output_dir, exist_ok=True)
+        set_page_workers(parsed_args.page_workers)
+        set_cache_format(parsed_args.pdf_cache_format)
+        set_download_workers(parsed_args.download_workers)
+        set_base_url(parsed_args.download_base_url)
+        for issue in parsed_args.issues:
+            issue.only_law_pages = parsed_args.only_law_pages
+
+    @classmethod
+    def _report_metrics(cls, parsed_args: argparse.Namespace) -> None:
+        if cache.memory_cache is not None:
+            print(cache.memory_cache.report(), file=sys.stderr)
+        if parsed_args.metrics_report is not None:
+            with open(parsed_args.metrics_report, 'w', encoding='utf-8') as metrics_file:
+                write_metrics_report(metrics_file)
+        else:
+            print("Cache metrics:", file=sys.stderr)
+            write_metrics_report(sys.stderr)
+
+    def run(self, argv: Sequence[str]) -> None:
+        parsed_args = self.argparser.parse_args(argv)
+        self._configure_from_args(parsed_args)
 
         if parsed_args.workers > 1:
             worker_mode = "using at most {} worker processes".format(parsed_args.workers)
         else:
             worker_mode = "using single-threaded mode"
 
+        if parsed_args.revalidate:
+            changed_count = revalidate_issues(parsed_args.issues)
+            print("{} issue(s) changed on the server".format(changed_count), file=sys.stderr)
+
         print("Starting extraction of {} issue(s) {}".format(len(parsed_args.issues), worker_mode), file=sys.stderr)
         output_fn = getattr(self, "output_" + parsed_args.output_format)
         output_class = self.EXTRACTION_STEP_TO_CLASS[parsed_args.extraction_step]
-        for extracted in do_extraction(parsed_args.issues, (output_class,), workers=parsed_args.workers):
+        for extracted in do_extraction(
+                parsed_args.issues, (output_class,),
+                workers=parsed_args.workers,
+                prefetch_depth=parsed_args.download_workers,
+                object_filter=ActIdentifierFilter(parsed_args.single_act) if parsed_args.single_act is not None else None,
+        ):
             if output_class in (BlockAmendmentOnlyAct, StructureOnlyAct):
                 extracted = extracted.act
-            if output_class in (Act, MagyarKozlonyLawRawText):
-                if parsed_args.single_act is not None and extracted.identifier != parsed_args.single_act:
-                    print("Not outputting {}".format(extracted.identifier), file=sys.stderr)
-                    continue
             if parsed_args.output_dir is not None:
                 file_path = os.path.join(
                     parsed_args.output_dir,
@@ -117,6 +256,25 @@ class GenerateCommand:
             else:
                 output_fn(extracted, sys.stdout)
 
+        self._report_metrics(parsed_args)
+        if parsed_args.max_cache_size is not None:
+            evict_to_size(parsed_args.max_cache_size)
+
+    @classmethod
+    def issues_from_act_list(cls, from_year: Optional[int], to_year: Optional[int], acts: Optional[Sequence[str]]) -> List[KozlonyToDownload]:
+        selected_issues = select_issues(load_act_to_mk_issue(), from_year=from_year, to_year=to_year, act_identifiers=acts)
+        return [KozlonyToDownload(year, issue) for year, issue in selected_issues]
+
+    @classmethod
+    def deduplicate_issues(cls, issues: Iterable[KozlonyToDownload]) -> List[KozlonyToDownload]:
+        result = []
+        seen = set()
+        for issue in issues:
+            if (issue.year, issue.issue) not in seen:
+                seen.add((issue.year, issue.issue))
+                result.append(issue)
+        return result
+
     @classmethod
     def output_txt(cls, extracted: Union[Act, MagyarKozlonyLawRawText], output_file: TextIO) -> None:
         write_txt(extracted, output_file)
@@ -130,3 +288,129 @@ class GenerateCommand:
         if not isinstance(extracted, Act):
             raise TypeError("Html output is only supported for Acts")
         generate_html_for_act(extracted, output_file)
+
+
+GC_DESCRIPTION = """
+Hun-Law cache garbage collector.
+
+Removes the cache entries that were created by older versions of the code,
+and optionally the least recently used ones, to limit the size of the cache.
+"""
+
+
+class GarbageCollectCommand:
+    def __init__(self) -> None:
+        self.argparser = argparse.ArgumentParser(prog='generate_output.py gc', description=GC_DESCRIPTION)
+        self.argparser.add_argument(
+            '--max-size', type=parse_size, default=None,
+            help="Also remove the least recently used entries until the cache is smaller than this. "
+            "Parsed documents are removed before downloaded ones. Example: '20G'"
+        )
+        self.argparser.add_argument(
+            '--dry-run', '-n', action='store_true',
+            help="Only print what would be removed."
+        )
+        add_cache_arguments(self.argparser)
+
+    def run(self, argv: Sequence[str]) -> None:
+        parsed_args = self.argparser.parse_args(argv)
+        init_cache_from_args(parsed_args)
+        removed = collect_garbage(parsed_args.dry_run)
+        if parsed_args.max_size is not None:
+            removed.extend(evict_to_size(parsed_args.max_size, parsed_args.dry_run))
+        print(
+            "{} {} entries ({})".format(
+                "Would remove" if parsed_args.dry_run else "Removed",
+                len(removed),
+                format_size(sum(entry.size for entry in removed))
+            ),
+            file=sys.stderr
+        )
+        for stage, stats in sorted(get_cache_stats().items()):
+            print(
+                "{:<30} {:>8} entries {:>12}   last used {}".format(
+                    stage, stats.count, format_size(stats.size),
+                    time.strftime('%Y-%m-%d %H:%M', time.localtime(stats.last_accessed))
+                )
+            )
+
+
+EXPORT_DESCRIPTION = """
+Hun-Law cache exporter.
+
+Packs the selected cache entries into a single file, that can be imported
+into the cache of another machine with 'generate_output.py import-cache'.
+Entries created by older versions of the code are never exported.
+"""
+
+
+class ExportCacheCommand:
+    def __init__(self) -> None:
+        self.argparser = argparse.ArgumentParser(prog='generate_output.py export-cache', description=EXPORT_DESCRIPTION)
+        self.argparser.add_argument(
+            'bundle',
+            help="The file to write the entries into. Example: 'hun_law_cache.tar.gz'"
+        )
+        self.argparser.add_argument(
+            '--stage', action='append', default=None, dest='stages',
+            help="Only export the entries of this stage. Can be specified multiple times. "
+            "Downloaded issues are the 'source' stage, their checksums are 'manifest'. Example: 'parsed'"
+        )
+        self.argparser.add_argument(
+            '--year', action='append', default=None, type=int, dest='years',
+            help="Only export the entries of issues and Acts of this year. Can be specified multiple times."
+        )
+        self.argparser.add_argument(
+            '--fingerprint', action='append', default=None, dest='fingerprints',
+            help="Only export the entries created by the code version with this fingerprint (the part of "
+            "the entry name after the stage name). Can be specified multiple times."
+        )
+        add_cache_arguments(self.argparser)
+
+    def run(self, argv: Sequence[str]) -> None:
+        parsed_args = self.argparser.parse_args(argv)
+        init_cache_from_args(parsed_args)
+        selector = EntrySelector(parsed_args.stages, parsed_args.years, parsed_args.fingerprints)
+        count = export_bundle(parsed_args.bundle, selector)
+        print("Exported {} entries to {}".format(count, parsed_args.bundle), file=sys.stderr)
+
+
+IMPORT_DESCRIPTION = """
+Hun-Law cache importer.
+
+Imports the entries of a file created with 'generate_output.py export-cache'.
+Entries that were created by a different version of the code, and entries
+that are already in the cache are skipped.
+"""
+
+
+class ImportCacheCommand:
+    def __init__(self) -> None:
+        self.argparser = argparse.ArgumentParser(prog='generate_output.py import-cache', description=IMPORT_DESCRIPTION)
+        self.argparser.add_argument(
+            'bundle',
+            help="The file created by export-cache."
+        )
+        add_cache_arguments(self.argparser)
+
+    def run(self, argv: Sequence[str]) -> None:
+        parsed_args = self.argparser.parse_args(argv)
+        init_cache_from_args(parsed_args)
+        result = import_bundle(parsed_args.bundle)
+        print(
+            "Imported {} entries. Skipped {} already present, {} incompatible and {} corrupt entries.".format(
+                result.imported, result.already_present, result.incompatible, result.corrupt
+            ),
+            file=sys.stderr
+        )
+
+
+def main(argv: Sequence[str]) -> None:
+    if argv[:1] == ['gc']:
+        GarbageCollectCommand().run(argv[1:])
+    elif argv[:1] == ['export-cache']:
+        ExportCacheCommand().run(argv[1:])
+    elif argv[:1] == ['import-cache']:
+        ImportCacheCommand().run(argv[1:])
+    else:
+        GenerateCommand().run(argv)
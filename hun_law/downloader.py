@@ -0,0 +1,483 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+
+# HTTP downloader that reuses connections, retries on transient errors, and
+# does not hammer the server. Sources can also be local directories, so that
+# a mirror can stand in for the original server during tests and offline runs.
+
+import email.utils
+import hashlib
+import http.client
+import io
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar, cast
+
+import attr
+
+from hun_law.cache import CacheObject
+from hun_law.cache_metrics import measure_time, update_metrics
+
+USER_AGENT = "hun_law"
+
+# Number of retries after the first failed attempt. The wait time between
+# attempts is doubled every time, starting from RETRY_BACKOFF seconds.
+RETRIES = 4
+RETRY_BACKOFF = 1.0
+
+# Minimum time between the start of two requests, across all threads.
+MIN_REQUEST_INTERVAL = 0.2
+
+TIMEOUT = 60.0
+
+CHUNK_SIZE = 1024 * 1024
+
+MANIFEST_SUFFIX = '.manifest.gz'
+PART_SUFFIX = '.part'
+# Validators of the response the .part file is from, for resuming it with If-Range
+PART_VALIDATORS_SUFFIX = PART_SUFFIX + '.json'
+
+T = TypeVar('T')
+
+# Number of concurrent downloads when downloading multiple files at once.
+# Should be set with set_download_workers()
+download_workers = 4
+
+
+def set_download_workers(workers: int) -> None:
+    global download_workers
+    download_workers = workers
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class Validators:
+    """HTTP validators of a downloaded file"""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Validators':
+        return cls(data.get('etag'), data.get('last_modified'))
+
+    @classmethod
+    def from_response(cls, response: http.client.HTTPResponse) -> 'Validators':
+        return cls(response.getheader('ETag'), response.getheader('Last-Modified'))
+
+    def to_dict(self) -> Dict[str, str]:
+        return {k: v for k, v in attr.asdict(self).items() if v is not None}
+
+    def is_empty(self) -> bool:
+        return self.etag is None and self.last_modified is None
+
+    def get_if_range(self) -> Optional[str]:
+        """Value of the If-Range header for resuming a download, or None if it cannot be resumed safely"""
+        # Weak ETags cannot be used in If-Range
+        if self.etag is not None and not self.etag.startswith('W/'):
+            return self.etag
+        return self.last_modified
+
+
+NO_VALIDATORS = Validators()
+
+ValidatorsCallback = Callable[[Validators], None]
+
+
+@attr.s(slots=True, auto_attribs=True)
+class PartialDownload:
+    """The output of a download, which may already contain the start of the file.
+
+    validators are the ones of the response the data already in output is from.
+    on_validators is called with the validators of every response before its body
+    is written, so that they can be stored for resuming an interrupted download later.
+    """
+    output: BinaryIO
+    validators: Validators = NO_VALIDATORS
+    on_validators: Optional[ValidatorsCallback] = None
+
+    @property
+    def offset(self) -> int:
+        return self.output.tell()
+
+    def restart(self) -> None:
+        self.output.seek(0)
+        self.output.truncate()
+        self.validators = NO_VALIDATORS
+
+    def start_response(self, validators: Validators) -> None:
+        self.validators = validators
+        if self.on_validators is not None:
+            self.on_validators(validators)
+
+
+class DownloadError(Exception):
+    def __init__(self, url: str, status: int, reason: str):
+        super().__init__("Could not download {}: HTTP {} {}".format(url, status, reason))
+        self.status = status
+
+    @property
+    def retriable(self) -> bool:
+        return self.status == 429 or self.status >= 500
+
+
+def calculate_manifest(filename: str) -> Dict[str, Any]:
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+            size += len(chunk)
+    return {'size': size, 'sha256': sha256.hexdigest()}
+
+
+def get_manifest_object(cache_object: CacheObject) -> CacheObject:
+    return cache_object.sidecar(MANIFEST_SUFFIX)
+
+
+def write_manifest(cache_object: CacheObject, validators: Optional[Validators] = None) -> None:
+    """Stores the size and hash of a downloaded file, along with the HTTP validators (ETag, Last-Modified) of the response"""
+    manifest = calculate_manifest(cache_object.get_filename())
+    manifest.update((validators or NO_VALIDATORS).to_dict())
+    get_manifest_object(cache_object).write_json(manifest)
+
+
+def read_manifest(cache_object: CacheObject) -> Dict[str, Any]:
+    manifest_object = get_manifest_object(cache_object)
+    if not manifest_object.exists():
+        # Downloaded by an older version. Nothing to check against, so trust it.
+        write_manifest(cache_object)
+    result: Dict[str, Any] = manifest_object.read_json()
+    return result
+
+
+def verify_manifest(cache_object: CacheObject) -> bool:
+    """Checks the size and the SHA-256 hash of a downloaded file against its manifest."""
+    manifest = read_manifest(cache_object)
+    if os.path.getsize(cache_object.get_filename()) != manifest['size']:
+        return False
+    return bool(calculate_manifest(cache_object.get_filename())['sha256'] == manifest['sha256'])
+
+
+def invalidate_derived_cache_objects(cache_object: CacheObject) -> None:
+    """Removes everything that was computed from a cached file.
+
+    Derived cache entries are named like the original, with an additional suffix,
+    e.g. MK/2013/31.pdf.parsed.<fingerprint>.<hash>.bin for MK/2013/31.pdf
+    """
+    for derived_object in cache_object.derived_objects():
+        if derived_object.name.endswith((MANIFEST_SUFFIX, PART_SUFFIX, PART_VALIDATORS_SUFFIX)):
+            continue
+        print("Removing outdated cache entry {}".format(derived_object.name), file=sys.stderr)
+        derived_object.delete()
+
+
+def parse_content_range_start(content_range: Optional[str]) -> Optional[int]:
+    """First byte position of a 'bytes <start>-<end>/<length>' Content-Range header"""
+    if content_range is None or not content_range.startswith('bytes '):
+        return None
+    start = content_range[len('bytes '):].split('-', 1)[0]
+    return int(start) if start.isdigit() else None
+
+
+def join_url(base_url: str, filename: str) -> str:
+    """Appends a filename to a base URL or to a local directory."""
+    if '://' in base_url:
+        return base_url.rstrip('/') + '/' + filename
+    return os.path.join(base_url, filename)
+
+
+class Downloader:
+    def __init__(self, *, retries: int = RETRIES, retry_backoff: float = RETRY_BACKOFF,
+                 min_request_interval: float = MIN_REQUEST_INTERVAL, timeout: float = TIMEOUT):
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.min_request_interval = min_request_interval
+        self.timeout = timeout
+        # Keep-alive connections, per thread, because http.client connections
+        # cannot be used by multiple threads at once.
+        self.thread_local = threading.local()
+        self.all_connections: List[http.client.HTTPConnection] = []
+        self.rate_limit_lock = threading.Lock()
+        self.next_request_time = 0.0
+
+    def wait_for_rate_limit(self) -> None:
+        with self.rate_limit_lock:
+            now = time.monotonic()
+            wait_until = max(now, self.next_request_time)
+            self.next_request_time = wait_until + self.min_request_interval
+        if wait_until > now:
+            time.sleep(wait_until - now)
+
+    def get_connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        connections: Dict[Tuple[str, str], http.client.HTTPConnection] = getattr(self.thread_local, 'connections', None) or {}
+        self.thread_local.connections = connections
+        connection = connections.get((scheme, netloc))
+        if connection is None:
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            connections[scheme, netloc] = connection
+            with self.rate_limit_lock:
+                self.all_connections.append(connection)
+        return connection
+
+    def drop_connection(self, scheme: str, netloc: str) -> None:
+        connection = self.thread_local.connections.pop((scheme, netloc), None)
+        if connection is not None:
+            connection.close()
+
+    def close(self) -> None:
+        with self.rate_limit_lock:
+            for connection in self.all_connections:
+                connection.close()
+            self.all_connections = []
+
+    @classmethod
+    def fetch_local_file(cls, path: str, download: PartialDownload, validators: Validators) -> Optional[Validators]:
+        # Local files are handled like a server that only supports Last-Modified.
+        last_modified = int(os.path.getmtime(path))
+        if validators.last_modified is not None:
+            if last_modified <= email.utils.parsedate_to_datetime(validators.last_modified).timestamp():
+                return None
+        new_validators = Validators(last_modified=email.utils.formatdate(last_modified, usegmt=True))
+        if download.offset and download.validators.last_modified != new_validators.last_modified:
+            # The file changed since the partial copy was made
+            download.restart()
+        download.start_response(new_validators)
+        with open(path, 'rb') as f:
+            f.seek(download.offset)
+            shutil.copyfileobj(f, download.output)
+        return new_validators
+
+    @classmethod
+    def get_request_headers(cls, download: PartialDownload, validators: Validators) -> Dict[str, str]:
+        headers = {'User-Agent': USER_AGENT}
+        if download.offset:
+            headers['Range'] = 'bytes={}-'.format(download.offset)
+            headers['If-Range'] = cast(str, download.validators.get_if_range())
+        if validators.etag is not None:
+            headers['If-None-Match'] = validators.etag
+        if validators.last_modified is not None:
+            headers['If-Modified-Since'] = validators.last_modified
+        return headers
+
+    @classmethod
+    def can_continue(cls, response: http.client.HTTPResponse, download: PartialDownload) -> bool:
+        """Returns False if the response cannot be appended to the partial download"""
+        if not download.offset:
+            return True
+        if response.status == 416:
+            # The partial data is probably complete, or from a different version of the file.
+            return False
+        # Do not risk mixing up the partial data with a range that was not requested
+        return response.status != 206 or parse_content_range_start(response.getheader('Content-Range')) == download.offset
+
+    @classmethod
+    def read_body(cls, response: http.client.HTTPResponse, output: BinaryIO) -> None:
+        received = 0
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            output.write(chunk)
+            received += len(chunk)
+        # http.client does not report connections closed too early.
+        expected = response.getheader('Content-Length')
+        if expected is not None and received < int(expected):
+            raise http.client.IncompleteRead(b'', int(expected) - received)
+
+    def handle_response(self, url: str, response: http.client.HTTPResponse, download: PartialDownload, validators: Validators) -> Optional[Validators]:
+        if response.status == 304 and not validators.is_empty():
+            response.read()
+            return None
+        if not self.can_continue(response, download):
+            response.read()
+            download.restart()
+            return self.fetch_once(url, download, validators)
+        if response.status == 200 and download.offset:
+            # Range requests are not supported, or the file changed (If-Range). Start over.
+            download.restart()
+        elif response.status not in (200, 206):
+            response.read()
+            raise DownloadError(url, response.status, response.reason)
+        new_validators = Validators.from_response(response)
+        download.start_response(new_validators)
+        self.read_body(response, download.output)
+        return new_validators
+
+    def fetch_once(self, url: str, download: PartialDownload, validators: Validators = NO_VALIDATORS) -> Optional[Validators]:
+        """Writes the rest of the contents of url to the output of the download.
+
+        The rest is only requested if the file did not change since the data already in
+        the output was downloaded (If-Range). Otherwise the output is truncated, and
+        everything is written. This also happens if the server cannot serve the requested range.
+        If validators of a previous download are given, the request is conditional, and
+        None is returned if the file did not change. Otherwise the new validators are returned.
+        """
+        parsed_url = urllib.parse.urlsplit(url)
+        if parsed_url.scheme in ('', 'file'):
+            path = urllib.parse.unquote(parsed_url.path) if parsed_url.scheme else url
+            return self.fetch_local_file(path, download, validators)
+
+        if download.offset and download.validators.get_if_range() is None:
+            # There is no way to tell if the partial data is from the current version of the file
+            download.restart()
+        self.wait_for_rate_limit()
+        path = parsed_url.path or '/'
+        if parsed_url.query:
+            path = path + '?' + parsed_url.query
+        connection = self.get_connection(parsed_url.scheme, parsed_url.netloc)
+        try:
+            connection.request('GET', path, headers=self.get_request_headers(download, validators))
+            return self.handle_response(url, connection.getresponse(), download, validators)
+        except (OSError, http.client.HTTPException):
+            # The server may have closed the kept-alive connection, or it is in
+            # an unknown state. Either way, the next attempt uses a new one.
+            self.drop_connection(parsed_url.scheme, parsed_url.netloc)
+            raise
+
+    def retry(self, url: str, fn: Callable[[], T]) -> T:
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except DownloadError as e:
+                if not e.retriable or attempt >= self.retries:
+                    raise
+            except (OSError, http.client.HTTPException):
+                if attempt >= self.retries:
+                    raise
+            wait_time = self.retry_backoff * 2 ** attempt
+            print("Download of {} failed, retrying in {} seconds".format(url, wait_time), file=sys.stderr)
+            time.sleep(wait_time)
+            attempt += 1
+
+    def fetch(self, url: str) -> bytes:
+        output = io.BytesIO()
+        download = PartialDownload(output)
+
+        def fetch_rest() -> None:
+            self.fetch_once(url, download)
+        self.retry(url, fetch_rest)
+        return output.getvalue()
+
+    def fetch_to_file(self, url: str, filename: str, validators: Validators = NO_VALIDATORS) -> Optional[Validators]:
+        """Downloads url to filename atomically.
+
+        The data is first written to a temporary file, and renamed after the download
+        is complete. Interrupted downloads (even in previous runs) are resumed with
+        range requests, if the file did not change in the meantime.
+        The download is conditional if validators are given, see fetch_once().
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        part_filename = filename + PART_SUFFIX
+        part_validators_filename = filename + PART_VALIDATORS_SUFFIX
+
+        def save_part_validators(part_validators: Validators) -> None:
+            with open(part_validators_filename, 'w', encoding='utf-8') as f:
+                json.dump(part_validators.to_dict(), f)
+
+        def fetch_rest() -> Optional[Validators]:
+            part_validators = NO_VALIDATORS
+            if os.path.exists(part_validators_filename):
+                with open(part_validators_filename, encoding='utf-8') as f:
+                    part_validators = Validators.from_dict(json.load(f))
+            with open(part_filename, 'ab') as f:
+                return self.fetch_once(url, PartialDownload(f, part_validators, save_part_validators), validators)
+        new_validators = self.retry(url, fetch_rest)
+        if new_validators is None:
+            os.unlink(part_filename)
+        else:
+            os.replace(part_filename, filename)
+        if os.path.exists(part_validators_filename):
+            os.unlink(part_validators_filename)
+        return new_validators
+
+    def download_to_cache(self, url: str, cache_object: CacheObject) -> None:
+        # Locked, so that concurrent processes do not write the same .part file
+        with cache_object.lock():
+            if cache_object.exists():
+                if verify_manifest(cache_object):
+                    update_metrics(cache_object.stage, hits=1)
+                    return
+                print("Cached file {} is corrupt, downloading again".format(cache_object.get_filename()), file=sys.stderr)
+                # Files in read-only cache layers are left alone, the new version hides them.
+                if os.path.exists(cache_object.get_writable_filename()):
+                    os.unlink(cache_object.get_writable_filename())
+            print("Downloading {}".format(url), file=sys.stderr)
+            with measure_time(cache_object.stage, 'compute_time'):
+                validators = self.fetch_to_file(url, cache_object.get_writable_filename())
+            update_metrics(cache_object.stage, misses=1, bytes_written=cache_object.size_on_disk())
+            write_manifest(cache_object, validators)
+
+    def revalidate_cache(self, url: str, cache_object: CacheObject) -> bool:
+        """Checks if the cached version of the file is still up to date, and updates it if not.
+
+        Returns True if the file changed. In this case, all cache entries derived
+        from it are removed.
+        """
+        if not cache_object.exists():
+            self.download_to_cache(url, cache_object)
+            return False
+        with cache_object.lock():
+            manifest = read_manifest(cache_object)
+            validators = Validators.from_dict(manifest)
+            filename = cache_object.get_writable_filename()
+            # Download into a separate file, so that the old version can be compared to it.
+            new_filename = filename + '.new'
+            new_validators = self.fetch_to_file(url, new_filename, validators)
+            if new_validators is None:
+                return False
+            if calculate_manifest(new_filename)['sha256'] == manifest['sha256']:
+                # E.g. the server does not support conditional requests, or the
+                # file was only touched. Store the new validators anyway.
+                os.unlink(new_filename)
+                write_manifest(cache_object, new_validators)
+                return False
+            print("{} changed, updating the cache".format(url), file=sys.stderr)
+            os.replace(new_filename, filename)
+            write_manifest(cache_object, new_validators)
+            invalidate_derived_cache_objects(cache_object)
+            return True
+
+    def revalidate_all_caches(self, downloads: Iterable[Tuple[str, CacheObject]], workers: Optional[int] = None) -> int:
+        """Revalidates multiple files concurrently. Returns the number of changed files"""
+        if workers is None:
+            workers = download_workers
+        downloads = list(downloads)
+        if not downloads:
+            return 0
+        with ThreadPoolExecutor(max(1, min(workers, len(downloads)))) as executor:
+            futures = [executor.submit(self.revalidate_cache, url, cache_object) for url, cache_object in downloads]
+            return sum(future.result() for future in futures)
+
+
+_downloader: Optional[Downloader] = None
+
+
+def get_downloader() -> Downloader:
+    """Returns the shared downloader of the process, so that connections are reused."""
+    global _downloader
+    if _downloader is None:
+        _downloader = Downloader()
+    return _downloader
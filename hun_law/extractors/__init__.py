@@ -15,7 +15,13 @@
 # You should have received a copy of the GNU General Public License
 # along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Dict, Callable, List, Type, Any, TypeVar, Iterable
+from typing import Dict, Callable, List, Type, Any, TypeVar, Iterable, Optional, Tuple
+import functools
+
+from hun_law import dict2object
+from hun_law.cache import CacheObject, is_cache_initialized
+from hun_law.cache_keys import CacheStage
+from hun_law.cache_metrics import measure_time, update_metrics
 
 GenericExtractorFn = Callable[[Any], Iterable[Any]]
 
@@ -39,3 +45,98 @@ def Extractor(extractable_class: Type[ExtractedType]) -> Callable[[ExtractorFn],
         extractors_for_class[extractable_class].append(fn)
         return fn
     return actual_decorator
+
+
+# Human readable identifier and hash of the input of a cached extractor
+CacheInput = Tuple[str, str]
+
+
+def CachedExtractor(
+        extractable_class: Type[ExtractedType],
+        result_class: Type,
+        stage: CacheStage,
+        get_cache_input: Callable[[ExtractedType], Optional[CacheInput]],
+) -> Callable[[ExtractorFn], ExtractorFn]:
+    """Decorator that registers an extractor function, and caches its results.
+
+    The results (which should all be of type 'result_class') are stored with
+    dict2object, keyed by the fingerprint of 'stage' and the value returned by
+    get_cache_input. If it returns None, the results are not cached.
+    The cache is not used if it was not initialized. The results may be shared
+    through the memory cache, so they must not be modified.
+    """
+    converters: List[dict2object.Converter] = []
+
+    def get_converter() -> dict2object.Converter:
+        # Created lazily, because this is slow for big classes.
+        if not converters:
+            converters.append(dict2object.get_converter(result_class))
+        return converters[0]
+
+    def actual_decorator(fn: ExtractorFn) -> ExtractorFn:
+        @functools.wraps(fn)
+        def cached_fn(data: ExtractedType) -> Iterable[Any]:
+            cache_input = get_cache_input(data) if is_cache_initialized() else None
+            if cache_input is None:
+                yield from fn(data)
+                return
+            cache_object = CacheObject(stage.cache_key(*cache_input) + ".gz")
+            converter = get_converter()
+            results: Optional[List[Any]] = None
+            if not cache_object.exists():
+                with cache_object.lock():
+                    # Check again, it might have been computed by someone else while waiting for the lock
+                    if not cache_object.exists():
+                        with measure_time(stage.name, 'compute_time'):
+                            results = list(fn(data))
+                        update_metrics(stage.name, misses=1)
+                        cache_object.write_json([converter.to_dict(r) for r in results])
+                        cache_object.remember_decoded(results)
+            if results is None:
+                update_metrics(stage.name, hits=1)
+                results = cache_object.read_decoded(lambda o: [converter.to_object(d) for d in o.read_json()])
+            yield from results
+        return Extractor(extractable_class)(cached_fn)
+    return actual_decorator
+
+
+PrefetcherFn = Callable[[Any], None]
+
+prefetchers_for_class: Dict[Type, List[PrefetcherFn]] = {}
+
+
+def Prefetcher(prefetchable_class: Type[ExtractedType]) -> Callable[[PrefetcherFn], PrefetcherFn]:
+    """Decorator that registers a prefetcher function.
+
+    Prefetcher functions accept a parameter of type 'prefetchable_class', and
+    do the I/O heavy parts of its extraction in advance, e.g. downloading.
+    They are run in background threads, and their results should be stored
+    in the cache, so that the extractors find them there.
+    """
+    def actual_decorator(fn: PrefetcherFn) -> PrefetcherFn:
+        if prefetchable_class not in prefetchers_for_class:
+            prefetchers_for_class[prefetchable_class] = []
+        prefetchers_for_class[prefetchable_class].append(fn)
+        return fn
+    return actual_decorator
+
+
+WorkItemCostFn = Callable[[Any], int]
+
+work_item_costs: Dict[Type, WorkItemCostFn] = {}
+
+
+def WorkItem(work_item_class: Type[ExtractedType]) -> Callable[[WorkItemCostFn], WorkItemCostFn]:
+    """Decorator that registers the cost function of a work item class.
+
+    When extracting with multiple worker processes, objects of type 'work_item_class'
+    are not processed further by the worker that extracted them, but sent back to
+    the scheduler, and processed as separate tasks, the most expensive ones first.
+    The decorated function estimates the cost of processing an object. Costs of
+    all classes are compared to each other, so they should be on a similar scale.
+    Work item objects have to be picklable.
+    """
+    def actual_decorator(fn: WorkItemCostFn) -> WorkItemCostFn:
+        work_item_costs[work_item_class] = fn
+        return fn
+    return actual_decorator
@@ -14,48 +14,104 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
-from typing import Iterable
+from typing import Iterable, Optional, Tuple
 
 import attr
+import tatsu
 
 from hun_law.structure import Act
 from hun_law.parsers.structure_parser import ActStructureParser
 from hun_law.parsers.semantic_parser import ActSemanticsParser, ActBlockAmendmentParser
-from hun_law.fixups.common import do_all_fixups
+from hun_law.fixups.common import do_all_fixups, fixups_fingerprint
+from hun_law.cache_keys import CacheStage, hash_strings
+from hun_law.grammar import grammar_file_hash
 
 # TODO: this is a hacky way to enable text fixups
 # pylint: disable=unused-import
 from hun_law.fixups import text_fixups
 
-from . import Extractor
+from . import CachedExtractor, CacheInput, WorkItem
 from .magyar_kozlony import MagyarKozlonyLawRawText
 
 
 @attr.s(slots=True, auto_attribs=True)
 class StructureOnlyAct:
     act: Act
+    # The raw text the Act was parsed from, used as the cache key of the later stages.
+    source: Optional[CacheInput] = attr.ib(default=None, eq=False)
 
 
 @attr.s(slots=True, auto_attribs=True)
 class BlockAmendmentOnlyAct:
     act: Act
+    source: Optional[CacheInput] = attr.ib(default=None, eq=False)
 
 
-@Extractor(MagyarKozlonyLawRawText)
+@WorkItem(StructureOnlyAct)
+def structure_only_act_cost(structure_only: StructureOnlyAct) -> int:
+    # Semantic parsing is done paragraph by paragraph. A paragraph takes much longer
+    # than a line of structure parsing, so this is on the same scale as raw_text_cost()
+    return sum(len(article.children) for article in structure_only.act.articles)
+
+
+def get_grammar_version() -> str:
+    return hash_strings(tatsu.__version__, grammar_file_hash)
+
+
+# All stages depend on the code of the previous ones too, so that all of them can
+# be keyed by the raw text. The fixups are part of the key of the raw text instead,
+# so that changing the fixups of one Act does not invalidate all others.
+ACT_PARSER_MODULES = (
+    'hun_law.extractors.act',
+    'hun_law.parsers.structure_parser',
+    'hun_law.fixups.common',
+    'hun_law.structure',
+    'hun_law.utils',
+    'hun_law.dict2object',
+)
+ACT_SEMANTICS_MODULES = ACT_PARSER_MODULES + (
+    'hun_law.parsers.semantic_parser',
+    'hun_law.parsers.grammatical_analyzer',
+)
+STRUCTURE_ONLY_ACT_CACHE_STAGE = CacheStage('structure_only_act', ACT_PARSER_MODULES)
+BLOCK_AMENDMENT_ONLY_ACT_CACHE_STAGE = CacheStage('block_amendment_only_act', ACT_SEMANTICS_MODULES, (get_grammar_version, ))
+ACT_CACHE_STAGE = CacheStage('act', ACT_SEMANTICS_MODULES, (get_grammar_version, ))
+
+
+# The cache input of the last raw text. On a cache miss, it is needed both for the
+# lookup and for the source of the result, and hashing the whole body is not cheap.
+_last_raw_text_cache_input: Optional[Tuple[MagyarKozlonyLawRawText, CacheInput]] = None
+
+
+def get_raw_text_cache_input(raw: MagyarKozlonyLawRawText) -> CacheInput:
+    global _last_raw_text_cache_input
+    last = _last_raw_text_cache_input
+    if last is not None and last[0] is raw:
+        return last[1]
+    line_hashes = (hash_strings(repr(line.parts), repr(line.margin_right)) for line in raw.body)
+    result = (
+        'acts/' + raw.identifier,
+        hash_strings(raw.identifier, str(raw.publication_date), raw.subject, fixups_fingerprint(raw.identifier), *line_hashes),
+    )
+    _last_raw_text_cache_input = (raw, result)
+    return result
+
+
+@CachedExtractor(MagyarKozlonyLawRawText, StructureOnlyAct, STRUCTURE_ONLY_ACT_CACHE_STAGE, get_raw_text_cache_input)
 def MagyarKozlonyToStructureOnlyAct(raw: MagyarKozlonyLawRawText) -> Iterable[StructureOnlyAct]:
     # TODO: assert for 10. § (2)(c) c): 'a cím utolsó szavához a „-ról”, „-ről” rag kapcsolódjon.'
     fixupped_body = do_all_fixups(raw.identifier, raw.body)
     act = ActStructureParser.parse(raw.identifier, raw.publication_date, raw.subject, tuple(fixupped_body))
-    yield StructureOnlyAct(act)
+    yield StructureOnlyAct(act, get_raw_text_cache_input(raw))
 
 
-@Extractor(StructureOnlyAct)
+@CachedExtractor(StructureOnlyAct, BlockAmendmentOnlyAct, BLOCK_AMENDMENT_ONLY_ACT_CACHE_STAGE, lambda structure_only: structure_only.source)
 def EnrichActWithBlockAmendments(structure_only: StructureOnlyAct) -> Iterable[BlockAmendmentOnlyAct]:
     act = ActBlockAmendmentParser.parse(structure_only.act)
-    yield BlockAmendmentOnlyAct(act)
+    yield BlockAmendmentOnlyAct(act, structure_only.source)
 
 
-@Extractor(BlockAmendmentOnlyAct)
+@CachedExtractor(BlockAmendmentOnlyAct, Act, ACT_CACHE_STAGE, lambda block_amendment_only: block_amendment_only.source)
 def EnrichActWithOtherSemanticData(block_amendment_only: BlockAmendmentOnlyAct) -> Iterable[Act]:
     act = ActSemanticsParser.add_semantics_to_act(block_amendment_only.act)
     yield act
@@ -15,29 +15,57 @@
 # You should have received a copy of the GNU General Public License
 # along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Any, Iterable, Tuple, Type, Sequence
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple, Type, Sequence
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue
+import heapq
+import itertools
 import multiprocessing
+import multiprocessing.pool
 
-from . import extractors_for_class
+from hun_law.cache import flush_cache
+from hun_law.cache_metrics import StageMetrics, take_metrics, merge_metrics, reset_metrics
+
+from . import extractors_for_class, prefetchers_for_class, work_item_costs
 
 # Yes, this is a hacky way to get all extractors, but you don't get to
 # judge me, pylint.
 # pylint: disable=unused-import
 from . import file, kozlonyok_hu_downloader, magyar_kozlony, pdf, act
 
+# Returns False for intermediate objects that should not be processed any further.
+ObjectFilter = Callable[[Any], bool]
+
 
 # This hack is needed instead of a lambda or wrapped function, since neither of these
 # can be pickled by default, which in turn is needed for multiprocessing's map()
 class _DoExtractionWrapper:
-    def __init__(self, result_classes: Tuple[Type, ...]):
+    def __init__(self, result_classes: Tuple[Type, ...], object_filter: Optional[ObjectFilter] = None):
         self.result_classes = result_classes
+        self.object_filter = object_filter
 
-    def __call__(self, o: Any) -> Iterable[Any]:
+    def __call__(self, o: Any) -> Tuple[List[Any], List[Any], Dict[str, StageMetrics]]:
         # Listify, because a generator result cannot be pickled.
-        return list(self.do_work((o, ), self.result_classes))
+        work_items: List[Any] = []
+        result = list(self.do_work((o, ), self.result_classes, self.object_filter, work_items))
+        # Worker processes do not get to run their exit handlers.
+        flush_cache()
+        # The new work items and the metrics are sent back to the main process along with the results
+        return result, work_items, take_metrics()
 
     @staticmethod
-    def do_work(objects: Iterable[Any], result_classes: Tuple[Type, ...] = ()) -> Iterable[Any]:
+    def do_work(
+            objects: Iterable[Any],
+            result_classes: Tuple[Type, ...] = (),
+            object_filter: Optional[ObjectFilter] = None,
+            work_items: Optional[List[Any]] = None,
+    ) -> Iterable[Any]:
+        """Extracts the objects until objects of result_classes are reached.
+
+        If work_items is not None, the extracted objects of registered work item
+        classes are appended to it, instead of being processed.
+        """
         global extractors_for_class
         queue = list(objects)  # simple copy, or listify if not list
         while queue:
@@ -47,18 +75,159 @@ class _DoExtractionWrapper:
             else:
                 for extractor_fn in extractors_for_class[data.__class__]:
                     for extracted in extractor_fn(data):
-                        queue.append(extracted)
+                        if object_filter is not None and not object_filter(extracted):
+                            continue
+                        if work_items is not None and extracted.__class__ in work_item_costs and extracted.__class__ not in result_classes:
+                            work_items.append(extracted)
+                        else:
+                            queue.append(extracted)
+
+
+class WorkItemQueue:
+    """Priority queue of work items, the most expensive one first.
+
+    Items with the same cost are returned in the order they were added.
+    """
+
+    def __init__(self) -> None:
+        self.heap: List[Tuple[int, int, Any]] = []
+        self.counter = itertools.count()
+
+    def push(self, item: Any) -> None:
+        cost = work_item_costs[item.__class__](item)
+        heapq.heappush(self.heap, (-cost, next(self.counter), item))
+
+    def pop(self) -> Any:
+        return heapq.heappop(self.heap)[2]
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+
+class PoolTasks:
+    """Tasks running on a process pool, whose results can be taken in the order they finish."""
 
+    def __init__(self, pool: multiprocessing.pool.Pool, fn: Callable[[Any], Any]) -> None:
+        self.pool = pool
+        self.fn = fn
+        # (success, result or exception) pairs, filled by the result handler thread of the pool
+        self.finished: 'Queue[Tuple[bool, Any]]' = Queue()
+        self.in_flight = 0
 
-def _do_extraction_multithreaded(objects: Iterable[Any], result_classes: Tuple[Type, ...], workers: int) -> Iterable[Any]:
-    with multiprocessing.Pool(workers) as pool:
-        for result in pool.imap_unordered(_DoExtractionWrapper(result_classes), objects):
+    def submit(self, o: Any) -> None:
+        self.pool.apply_async(
+            self.fn, (o, ),
+            callback=lambda r: self.finished.put((True, r)),
+            error_callback=lambda e: self.finished.put((False, e)),
+        )
+        self.in_flight += 1
+
+    def get_finished(self) -> Any:
+        """Waits for a task to finish, and returns its result, or raises its exception."""
+        success, value = self.finished.get()
+        self.in_flight -= 1
+        if not success:
+            raise value
+        return value
+
+    def __len__(self) -> int:
+        return self.in_flight
+
+
+def run_prefetchers(o: Any) -> None:
+    for prefetcher_fn in prefetchers_for_class.get(o.__class__, ()):
+        prefetcher_fn(o)
+
+
+def prefetch(objects: Iterable[Any], depth: int) -> Iterable[Any]:
+    """Yields the objects in order, after their prefetchers finished.
+
+    Meanwhile, the prefetchers of the next 'depth' objects are run in the background,
+    so that e.g. the next issues are downloaded while the current one is processed.
+    """
+    if depth <= 0:
+        yield from objects
+        return
+    with ThreadPoolExecutor(depth) as executor:
+        in_flight: Deque[Tuple[Any, Future]] = deque()
+        for o in objects:
+            in_flight.append((o, executor.submit(run_prefetchers, o)))
+            if len(in_flight) > depth:
+                ready, future = in_flight.popleft()
+                future.result()
+                yield ready
+        while in_flight:
+            ready, future = in_flight.popleft()
+            future.result()
+            yield ready
+
+
+def _do_extraction_multithreaded(
+        objects: Iterable[Any],
+        wrapper: _DoExtractionWrapper,
+        workers: int,
+        prefetch_depth: int
+) -> Iterable[Any]:
+    """Schedules the objects, and the work items extracted from them, on a process pool.
+
+    At most 'workers' tasks are in flight, so that the work items are not queued up
+    in the pool, but can be ordered by their cost. Work items are started before new
+    input objects, so that results come out early, and memory usage stays bounded.
+    """
+    # Pending cache writes would be inherited by the workers otherwise
+    flush_cache()
+    inputs = iter(prefetch(objects, prefetch_depth))
+    inputs_exhausted = False
+    work_items = WorkItemQueue()
+    # Forked workers would send the metrics of the main process back otherwise
+    with multiprocessing.Pool(workers, initializer=reset_metrics) as pool:
+        tasks = PoolTasks(pool, wrapper)
+        while True:
+            while len(tasks) < workers:
+                if work_items:
+                    o = work_items.pop()
+                elif not inputs_exhausted:
+                    o = next(inputs, None)
+                    if o is None:
+                        inputs_exhausted = True
+                        break
+                else:
+                    break
+                tasks.submit(o)
+            if not tasks:
+                break
+            result, new_work_items, metrics = tasks.get_finished()
+            merge_metrics(metrics)
+            for work_item in new_work_items:
+                work_items.push(work_item)
             yield from result
 
 
-def do_extraction(objects: Sequence[Any], result_classes: Tuple[Type, ...] = (), *, workers: int = 1) -> Iterable[Any]:
-    """Processes all objects, and returns the end result processed objects."""
-    if workers > 1 and len(objects) > 1:
-        yield from _do_extraction_multithreaded(objects, result_classes, min(workers, len(objects)))
+def do_extraction(
+        objects: Sequence[Any],
+        result_classes: Tuple[Type, ...] = (),
+        *,
+        workers: int = 1,
+        prefetch_depth: int = 0,
+        object_filter: Optional[ObjectFilter] = None,
+) -> Iterable[Any]:
+    """Processes all objects, and returns the end result processed objects.
+
+    If prefetch_depth is not 0, the registered prefetchers (e.g. downloads) of that
+    many upcoming objects are run in the background while processing the current ones.
+    Extracted objects for which object_filter returns False are dropped immediately.
+    object_filter has to be picklable, if workers > 1.
+
+    With multiple workers, registered work items (e.g. the individual Acts of an issue)
+    are processed as separate tasks, so even a single object can use all workers.
+    """
+    wrapper = _DoExtractionWrapper(result_classes, object_filter)
+    if workers > 1:
+        yield from _do_extraction_multithreaded(objects, wrapper, workers, prefetch_depth)
+    elif prefetch_depth > 0:
+        # Objects are processed one by one, so that processing can start as soon
+        # as the first one is prefetched.
+        for o in prefetch(objects, prefetch_depth):
+            yield from wrapper.do_work((o, ), result_classes, object_filter)
     else:
-        yield from _DoExtractionWrapper.do_work(objects, result_classes)
+        yield from wrapper.do_work(objects, result_classes, object_filter)
@@ -15,8 +15,18 @@
 # You should have received a copy of the GNU General Public License
 # along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
 
+from typing import Any, Callable, Collection, Optional, Sequence
+
+# Decides which pages of a PDF need to be interpreted, based on the first few pages.
+# Called with the leading pages interpreted so far (as a list of PageOfLines) and
+# the number of pages in the document. Returns the indexes of the pages that are
+# needed, or None, if it needs to see the next page too.
+PageSelector = Callable[[Sequence[Any], int], Optional[Collection[int]]]
+
 
 class PDFFileDescriptor:
-    def __init__(self, filename: str, cache_id: str) -> None:
+    def __init__(self, filename: str, cache_id: str, page_selector: Optional[PageSelector] = None) -> None:
+        self.filename = filename
+        self.page_selector = page_selector
         self.fp = open(filename, 'rb')
         self.cache_id = cache_id
@@ -15,33 +15,62 @@
 # You should have received a copy of the GNU General Public License
 # along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
 
-import sys
-from urllib import request
-from typing import Iterable
+from typing import Iterable, Optional
 
 from hun_law.cache import CacheObject
-from . import Extractor
+from hun_law.downloader import get_downloader, join_url
+from . import Extractor, Prefetcher
 from .file import PDFFileDescriptor
+from .magyar_kozlony import select_law_pages
+
+
+# Base URL of the issue PDFs. Can also be a local directory with the same file names.
+# Should be set with set_base_url()
+DEFAULT_BASE_URL = "http://www.kozlonyok.hu/nkonline/MKPDF/hiteles/"
+base_url = DEFAULT_BASE_URL
+
+
+def set_base_url(new_base_url: str) -> None:
+    global base_url
+    base_url = new_base_url
 
 
 class KozlonyToDownload:
-    URL_TEMPLATE = "http://www.kozlonyok.hu/nkonline/MKPDF/hiteles/MK{:02d}{:03d}.pdf"
+    FILENAME_TEMPLATE = "MK{:02d}{:03d}.pdf"
 
-    def __init__(self, year: int, issue: int) -> None:
+    def __init__(self, year: int, issue: int, *, only_law_pages: bool = False) -> None:
         self.year = year
         self.issue = issue
+        # Only interpret the pages of the Laws section, based on the table of contents
+        self.only_law_pages = only_law_pages
 
     def get_url(self) -> str:
-        return self.URL_TEMPLATE.format(self.year % 100, self.issue)
+        return join_url(base_url, self.FILENAME_TEMPLATE.format(self.year % 100, self.issue))
+
+    def get_cache_id(self) -> str:
+        return "MK/{}/{}.pdf".format(self.year, self.issue)
+
+    def get_cache_object(self) -> CacheObject:
+        return CacheObject(self.get_cache_id())
+
+
+def revalidate_issues(descriptors: Iterable[KozlonyToDownload], workers: Optional[int] = None) -> int:
+    """Checks if cached issues were changed on the server, and updates them if so.
+
+    Derived cache entries (e.g. parsed PDFs) of changed issues are removed.
+    Returns the number of changed issues.
+    """
+    return get_downloader().revalidate_all_caches(((d.get_url(), d.get_cache_object()) for d in descriptors), workers)
+
+
+@Prefetcher(KozlonyToDownload)
+def download_issue(descriptor: KozlonyToDownload) -> None:
+    get_downloader().download_to_cache(descriptor.get_url(), descriptor.get_cache_object())
 
 
 @Extractor(KozlonyToDownload)
 def MagyarKozlonyHeaderExtractor(descriptor: KozlonyToDownload) -> Iterable[PDFFileDescriptor]:
-    cache_id = "MK/{}/{}.pdf".format(descriptor.year, descriptor.issue)
-    cache_object = CacheObject(cache_id)
-    if not cache_object.exists():
-        url_to_download = descriptor.get_url()
-        print("Downloading {}".format(url_to_download), file=sys.stderr)
-        downloaded_data = request.urlopen(url_to_download).read()
-        cache_object.write_bytes(downloaded_data)
-    yield PDFFileDescriptor(cache_object.get_filename(), cache_id)
+    download_issue(descriptor)
+    cache_object = descriptor.get_cache_object()
+    page_selector = select_law_pages if descriptor.only_law_pages else None
+    yield PDFFileDescriptor(cache_object.get_filename(), descriptor.get_cache_id(), page_selector)
@@ -16,12 +16,12 @@
 # along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
 
 import re
-from typing import List, Dict, Optional, Type, Tuple, Iterable, Union, Callable
+from typing import Any, List, Dict, Optional, Type, Tuple, Iterable, Union, Callable, Sequence, Collection
 import attr
 
 from hun_law.utils import EMPTY_LINE, IndentedLine, Date
-from . import Extractor
-from .pdf import PdfOfLines
+from . import Extractor, WorkItem
+from .pdf import PdfOfLines, PageOfLines
 
 
 def is_magyar_kozlony(pdf_file: PdfOfLines) -> bool:
@@ -41,31 +41,44 @@ class PageWithHeader:
 @attr.s(slots=True, frozen=True, auto_attribs=True)
 class KozlonyPagesWithHeaderAndFooter:
     publication_date: Date
-    pages: Tuple[PageWithHeader, ...]
+    pdf_file: PdfOfLines
 
+    @property
+    def pages(self) -> Iterable[PageWithHeader]:
+        # Generated lazily on every access. This way pages are split into
+        # header and content only when the section extractor gets to them.
+        return iterate_pages_with_header(self.pdf_file)
 
-@Extractor(PdfOfLines)
-def MagyarKozlonyHeaderExtractor(pdf_file: PdfOfLines) -> Iterable[KozlonyPagesWithHeaderAndFooter]:
-    if not is_magyar_kozlony(pdf_file):
-        return
-    # TODO: assert the header.
 
-    # The first page is special:
+def split_header(page: PageOfLines, is_first_page: bool) -> PageWithHeader:
+    if is_first_page:
+        # The first page is special:
 
-    # MAGYAR KÖZLÖNY 71 . szám
-    #
-    # A MAGYAR KÖZTÁRSASÁG HIVATALOS LAPJA
-    # 2011. június 28., kedd
+        # MAGYAR KÖZLÖNY 71 . szám
+        #
+        # A MAGYAR KÖZTÁRSASÁG HIVATALOS LAPJA
+        # 2011. június 28., kedd
+        #
+        return PageWithHeader(tuple(page.lines[:5]), tuple(page.lines[5:]))
+    # Others are
+    # 15202 M A G Y A R   K Ö Z L Ö N Y  •  2011. évi 71 . szám
     #
+    return PageWithHeader(tuple(page.lines[:2]), tuple(page.lines[2:]))
 
-    publication_date = Date.from_hungarian_text(pdf_file.pages[0].lines[3].content)
-    result_pages = [PageWithHeader(tuple(pdf_file.pages[0].lines[:5]), tuple(pdf_file.pages[0].lines[5:]))]
+
+def iterate_pages_with_header(pdf_file: PdfOfLines) -> Iterable[PageWithHeader]:
+    # TODO: assert the header.
+    yield split_header(pdf_file.pages[0], True)
     for page in pdf_file.pages:
-        # Others are
-        # 15202 M A G Y A R   K Ö Z L Ö N Y  •  2011. évi 71 . szám
-        #
-        result_pages.append(PageWithHeader(tuple(page.lines[:2]), tuple(page.lines[2:])))
-    yield KozlonyPagesWithHeaderAndFooter(publication_date, tuple(result_pages))
+        yield split_header(page, False)
+
+
+@Extractor(PdfOfLines)
+def MagyarKozlonyHeaderExtractor(pdf_file: PdfOfLines) -> Iterable[KozlonyPagesWithHeaderAndFooter]:
+    if not is_magyar_kozlony(pdf_file):
+        return
+    publication_date = Date.from_hungarian_text(pdf_file.pages[0].lines[3].content)
+    yield KozlonyPagesWithHeaderAndFooter(publication_date, pdf_file)
 
 
 @attr.s(slots=True, frozen=True, auto_attribs=True)
@@ -134,6 +147,26 @@ class MagyarKozlonyLawRawText:
     body: Tuple[IndentedLine, ...]
 
 
+@WorkItem(MagyarKozlonyLawRawText)
+def raw_text_cost(raw: MagyarKozlonyLawRawText) -> int:
+    # One issue may contain a huge code and a few tiny Acts, so the Acts
+    # are parsed separately, the longest ones first.
+    return len(raw.body)
+
+
+class ActIdentifierFilter:
+    """Object filter for do_extraction, that drops every Act, except the one with the specified identifier.
+
+    A class instead of a closure, so that it can be sent to worker processes.
+    """
+
+    def __init__(self, identifier: str):
+        self.identifier = identifier
+
+    def __call__(self, o: Any) -> bool:
+        return not isinstance(o, MagyarKozlonyLawRawText) or o.identifier == self.identifier
+
+
 LawExtractorStateFn = Callable[[IndentedLine], None]
 
 
@@ -230,3 +263,71 @@ def MagyarKozlonyLawExtractor(laws_section: MagyarKozlonyLawsSection) -> Iterabl
         result = state_machine.feed_line(line)
         if result is not None:
             yield result
+
+
+# Used for skipping the pages of an issue that are not in the Laws section.
+# See select_law_pages()
+MAX_TABLE_OF_CONTENTS_PAGES = 10
+TABLE_OF_CONTENTS_ENTRY_END_RE = re.compile('^.*[^0-9] +([0-9]+)$')
+PAGE_NUMBER_IN_HEADER_RE = re.compile('^([0-9]+) |.* ([0-9]+)$')
+
+
+def parse_table_of_contents(lines: Iterable[IndentedLine], valid_page_numbers: range) -> List[Tuple[bool, int]]:
+    """Returns (is the entry an Act, page number) pairs for every entry in the table of contents."""
+    result = []
+    entry_first_line = None
+    for line in lines:
+        if line == EMPTY_LINE or line.content in SECTION_TYPES:
+            continue
+        if entry_first_line is None:
+            entry_first_line = line.content
+        # Entries look like this, possibly wrapped into multiple lines:
+        # 2011. évi LXXX. törvény  A Magyar Köztársaság 2011. évi költségvetéséről    15204
+        # The page numbers are continuous for the whole year.
+        entry_end = TABLE_OF_CONTENTS_ENTRY_END_RE.match(line.content)
+        if entry_end is not None and int(entry_end.group(1)) in valid_page_numbers:
+            is_act = LawExtractorStateMachine.HEADER_STARTING_RE.match(entry_first_line) is not None
+            result.append((is_act, int(entry_end.group(1))))
+            entry_first_line = None
+    return result
+
+
+def select_law_pages(leading_pages: Sequence[PageOfLines], page_count: int) -> Optional[Collection[int]]:
+    """PageSelector that only selects the pages of the Laws section, based on the table of contents.
+
+    If anything unexpected happens, all pages are selected, to be on the safe side.
+    """
+    all_pages = range(page_count)
+    first_page = split_header(leading_pages[0], True)
+    if not leading_pages[0].lines or 'MAGYAR KÖZLÖNY' not in leading_pages[0].lines[0].content or \
+            not first_page.lines or first_page.lines[0].content != 'Tartalomjegyzék':
+        return all_pages
+
+    # The table of contents ends where the next section starts.
+    last_page = split_header(leading_pages[-1], len(leading_pages) == 1)
+    if len(leading_pages) == 1 or not last_page.lines or last_page.lines[0].content not in SECTION_TYPES or \
+            last_page.lines[0].content == 'Tartalomjegyzék':
+        if len(leading_pages) > MAX_TABLE_OF_CONTENTS_PAGES:
+            return all_pages
+        return None
+
+    page_number_match = PAGE_NUMBER_IN_HEADER_RE.match(leading_pages[1].lines[0].content) if leading_pages[1].lines else None
+    if page_number_match is None:
+        return all_pages
+    first_page_number = int(page_number_match.group(1) or page_number_match.group(2)) - 1
+
+    toc_lines: List[IndentedLine] = list(first_page.lines)
+    for page in leading_pages[1:-1]:
+        toc_lines.extend(split_header(page, False).lines)
+    entries = parse_table_of_contents(toc_lines, range(first_page_number, first_page_number + page_count))
+    act_entry_indexes = [i for i, (is_act, _) in enumerate(entries) if is_act]
+    if not act_entry_indexes:
+        return ()
+
+    first_law_page = entries[act_entry_indexes[0]][1] - first_page_number
+    if act_entry_indexes[-1] + 1 < len(entries):
+        # The Laws section ends on the page where the next entry starts at the latest
+        last_law_page = entries[act_entry_indexes[-1] + 1][1] - first_page_number
+    else:
+        last_law_page = page_count - 1
+    return range(first_law_page, last_law_page + 1) if first_law_page <= last_law_page else all_pages
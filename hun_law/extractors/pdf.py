@@ -16,19 +16,25 @@
 # along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
 
 import unicodedata
+import multiprocessing
+import operator
+from array import array
 
-from typing import cast, List, Dict, Sequence, Any, Iterable
+from typing import cast, List, Dict, Sequence, Any, Iterable, Iterator, Optional, Container, Tuple, Union, overload
 
 import attr
 
+import pdfminer
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.pdfpage import PDFPage
 from pdfminer.pdfdevice import PDFTextDevice
 from pdfminer.pdffont import PDFUnicodeNotDefined, PDFFont
 
-from hun_law.utils import IndentedLine, IndentedLinePart, EMPTY_LINE, chr_latin2
+from hun_law.utils import IndentedLine, IndentedLinePartInterner, EMPTY_LINE, chr_latin2
 from hun_law.cache import CacheObject
-from hun_law import dict2object
+from hun_law.cache_keys import CacheStage, hash_file, hash_function, hash_modules
+from hun_law.cache_metrics import StageMetrics, measure_time, merge_metrics, reset_metrics, take_metrics, update_metrics
+from hun_law import dict2object, binary_format
 
 from . import Extractor
 from .file import PDFFileDescriptor
@@ -44,9 +50,50 @@ class TextBox:
     bold: bool
 
 
-@attr.s(slots=True, auto_attribs=True)
+@attr.s(slots=True)
 class PageOfTextBoxes:
-    textboxes: List[TextBox]
+    # Columnar storage of the TextBoxes on a page: the i-th glyph is described by
+    # the i-th element of every array. This is way more compact than having an
+    # object for every single glyph, and the arrays can be sorted by index.
+    x: 'array[float]' = attr.ib(factory=lambda: array('d'))
+    y: 'array[float]' = attr.ib(factory=lambda: array('d'))
+    width: 'array[float]' = attr.ib(factory=lambda: array('d'))
+    width_of_space: 'array[float]' = attr.ib(factory=lambda: array('d'))
+    bold: bytearray = attr.ib(factory=bytearray)
+    content_id: 'array[int]' = attr.ib(factory=lambda: array('I'))
+    # Interned content strings, indexed by content_id
+    contents: List[str] = attr.ib(factory=list)
+    _content_ids_by_content: Dict[str, int] = attr.ib(init=False, factory=dict)
+
+    def add_textbox(self, x: float, y: float, width: float, width_of_space: float, content: str, bold: bool) -> None:
+        # pylint: disable=too-many-arguments
+        content_id = self._content_ids_by_content.get(content)
+        if content_id is None:
+            content_id = len(self.contents)
+            self.contents.append(content)
+            self._content_ids_by_content[content] = content_id
+        self.x.append(x)
+        self.y.append(y)
+        self.width.append(width)
+        self.width_of_space.append(width_of_space)
+        self.bold.append(bold)
+        self.content_id.append(content_id)
+
+    def content(self, index: int) -> str:
+        return self.contents[self.content_id[index]]
+
+    def textbox(self, index: int) -> TextBox:
+        return TextBox(
+            self.x[index], self.y[index], self.width[index], self.width_of_space[index],
+            self.content(index), bool(self.bold[index]),
+        )
+
+    @property
+    def textboxes(self) -> List[TextBox]:
+        return [self.textbox(i) for i in range(len(self))]
+
+    def __len__(self) -> int:
+        return len(self.x)
 
 
 @attr.s(slots=True, auto_attribs=True)
@@ -54,15 +101,31 @@ class PdfOfTextBoxes:
     pages: List[PageOfTextBoxes]
 
 
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class DecodedGlyph:
+    text: str
+    # Widths are unscaled, i.e. they have to be multiplied by the font size and scaling
+    width: float
+    width_of_space: float
+    bold: bool
+    # False for whitespace and for ignored special characters
+    is_visible: bool
+
+
 class PDFMinerAdapter(PDFTextDevice):
     def __init__(self, rsrcmgr: PDFResourceManager):
         super().__init__(rsrcmgr)
-        self.pages: List[PageOfTextBoxes] = []
-        self.current_page = PageOfTextBoxes([])
+        # Only the page currently being interpreted is stored, so that the
+        # textboxes of the whole document are never in memory at the same time.
+        self.current_page = PageOfTextBoxes()
+        # Decoding a glyph is expensive, but a document only uses a handful of fonts,
+        # so the same glyphs are decoded over and over again.
+        self.glyph_cache: Dict[Tuple[PDFFont, int], DecodedGlyph] = {}
+        self.glyph_cache_hits = 0
+        self.glyph_cache_misses = 0
 
     def begin_page(self, page: Any, ctm: Any) -> None:
-        self.current_page = PageOfTextBoxes([])
-        self.pages.append(self.current_page)
+        self.current_page = PageOfTextBoxes()
 
     def end_page(self, page: Any) -> None:
         pass
@@ -103,13 +166,14 @@ class PDFMinerAdapter(PDFTextDevice):
         text = text.replace("û", "ű")  # note the ^ on top of the first ű
         return text
 
-    def render_char(self, matrix: Sequence[float], font: PDFFont, fontsize: float, scaling: float, rise: float, cid: int, *_args: Any) -> float:
-        # We need to support multiple pdfminer versions simultaneously.
-        # Hence the *args
-        # pylint: disable=arguments-differ,too-many-arguments
-        text = self.cid_to_string(font, cid)
-
-        textwidth: float = font.char_width(cid) * fontsize * scaling
+    @classmethod
+    def decode_glyph(cls, font: PDFFont, cid: int) -> DecodedGlyph:
+        text = cls.cid_to_string(font, cid)
+        unscaled_width_of_space = font.char_width(32)
+        if unscaled_width_of_space in (1.0, 0.0):
+            # Workaround for missing default width of space
+            # e.g. the font does not define the space character
+            unscaled_width_of_space = 0.25
 
         # Workaround for some malformed texts, such as the 2018 L. Act about the budget
         # in it, these weird "private" characters denote | signs, for constructing
@@ -117,25 +181,37 @@ class PDFMinerAdapter(PDFTextDevice):
         # exactly where other characters are, and that throws an error in later processing.
         # We will just throw these away for now, as it's in an appendix
         # And we do not even parse Appendixes (TODO)
-        if unicodedata.category(text[0]) in ('Co', 'Cf'):
-            return textwidth
-
-        if not text.isspace():
-            unscaled_width_of_space = font.char_width(32)
-            if unscaled_width_of_space in (1.0, 0.0):
-                # Workaround for missing default width of space
-                # e.g. the font does not define the space character
-                unscaled_width_of_space = 0.25
-            textbox = TextBox(
+        is_visible = unicodedata.category(text[0]) not in ('Co', 'Cf') and not text.isspace()
+        return DecodedGlyph(
+            text=text,
+            width=font.char_width(cid),
+            width_of_space=unscaled_width_of_space,
+            bold=cls.is_font_bold(font),
+            is_visible=is_visible,
+        )
+
+    def render_char(self, matrix: Sequence[float], font: PDFFont, fontsize: float, scaling: float, rise: float, cid: int, *_args: Any) -> float:
+        # We need to support multiple pdfminer versions simultaneously.
+        # Hence the *args
+        # pylint: disable=arguments-differ,too-many-arguments
+        glyph = self.glyph_cache.get((font, cid))
+        if glyph is None:
+            glyph = self.decode_glyph(font, cid)
+            self.glyph_cache[font, cid] = glyph
+            self.glyph_cache_misses += 1
+        else:
+            self.glyph_cache_hits += 1
+
+        textwidth: float = glyph.width * fontsize * scaling
+        if glyph.is_visible:
+            self.current_page.add_textbox(
                 x=matrix[4],
                 y=round(matrix[5], 3),
                 width=textwidth * matrix[0],
-                width_of_space=unscaled_width_of_space * fontsize * scaling * matrix[0],
-                content=text,
-                bold=self.is_font_bold(font),
+                width_of_space=glyph.width_of_space * fontsize * scaling * matrix[0],
+                content=glyph.text,
+                bold=glyph.bold,
             )
-            assert self.current_page is not None
-            self.current_page.textboxes.append(textbox)
         return textwidth
 
     # TODO: parse graphical lines, so that footers can be detected more easily
@@ -149,40 +225,233 @@ class PageOfLines:
         self.lines.append(line)
 
 
+def update_interner_metrics(interner: IndentedLinePartInterner, hits_before: int, saved_bytes_before: int) -> None:
+    """Adds the parts interned since the counters of the interner had the given values to the metrics"""
+    update_metrics(
+        PDF_CACHE_STAGE.name,
+        interned_parts=interner.hits - hits_before,
+        interner_saved_bytes=interner.saved_bytes - saved_bytes_before,
+    )
+
+
+class LazyPageList(Sequence[PageOfLines]):
+    """Read-only list of pages, that are decoded from the binary cache format on first access"""
+
+    def __init__(self, decoder: binary_format.Decoder):
+        self.decoder = decoder
+        self.pages: List[Optional[PageOfLines]] = [None] * decoder.page_count
+
+    def get_page(self, index: int) -> PageOfLines:
+        result = self.pages[index]
+        if result is None:
+            result = PageOfLines()
+            interner = self.decoder.interner
+            hits_before, saved_bytes_before = interner.hits, interner.saved_bytes
+            result.lines.extend(self.decoder.decode_page(index % len(self.pages)))
+            self.pages[index] = result
+            update_interner_metrics(interner, hits_before, saved_bytes_before)
+        return result
+
+    @overload
+    def __getitem__(self, index: int) -> PageOfLines:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[PageOfLines]:
+        ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[PageOfLines, List[PageOfLines]]:
+        if isinstance(index, slice):
+            return [self.get_page(i) for i in range(*index.indices(len(self.pages)))]
+        return self.get_page(index)
+
+    def __iter__(self) -> Iterator[PageOfLines]:
+        for i in range(len(self.pages)):
+            yield self.get_page(i)
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def __eq__(self, other: Any) -> bool:
+        # So that a PdfOfLines read from the cache is equal to the one it was written from.
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __reduce__(self) -> Any:
+        # mmap-ed data cannot be pickled, send the decoded pages instead.
+        return (list, (list(self),))
+
+
+def convert_page_list(pages: Iterable[PageOfLines]) -> List[PageOfLines]:
+    if isinstance(pages, LazyPageList):
+        # Not really a list, but it behaves like one, except for modifications.
+        return cast(List[PageOfLines], pages)
+    return list(pages)
+
+
 @attr.s(slots=True)
 class PdfOfLines:
-    pages: List[PageOfLines] = attr.ib(factory=list, converter=list)
+    pages: List[PageOfLines] = attr.ib(factory=list, converter=convert_page_list)
+    # Pages that were not interpreted at all (see PDFFileDescriptor.page_selector)
+    # are stored as empty pages. Their indexes are recorded here as [start, end) ranges.
+    skipped_page_ranges: List[Tuple[int, int]] = attr.ib(factory=list)
 
     def add_page(self, page: PageOfLines) -> None:
         self.pages.append(page)
 
 
-def extract_textboxes(f: PDFFileDescriptor) -> PdfOfTextBoxes:
+# Format of the parsed PDF cache files. Either 'binary' or 'json'.
+# Should be set with set_cache_format()
+cache_format = 'binary'
+CACHE_FORMATS = ('binary', 'json')
+
+# Number of worker processes used to interpret the pages of a single PDF.
+# Should be set with set_page_workers()
+page_workers = 1
+
+# Lower bound of the number of pages handed to a page worker at once. Every chunk
+# has to re-parse the document structure, so too small chunks are wasteful.
+MIN_PAGES_PER_CHUNK = 8
+
+
+def set_cache_format(new_format: str) -> None:
+    global cache_format
+    if new_format not in CACHE_FORMATS:
+        raise ValueError("Unknown PDF cache format: {}".format(new_format))
+    cache_format = new_format
+
+
+def set_page_workers(workers: int) -> None:
+    global page_workers
+    page_workers = workers
+
+
+def iterate_textboxes(f: PDFFileDescriptor, pagenos: Optional[Container[int]] = None) -> Iterable[PageOfTextBoxes]:
     rsrcmgr = PDFResourceManager()
     device = PDFMinerAdapter(rsrcmgr)
     interpreter = PDFPageInterpreter(rsrcmgr, device)
-    for page in PDFPage.get_pages(f.fp):
+    for page in PDFPage.get_pages(f.fp, pagenos):
         interpreter.process_page(page)
-    return PdfOfTextBoxes(device.pages)
+        update_metrics(PDF_CACHE_STAGE.name, glyph_cache_hits=device.glyph_cache_hits, glyph_cache_misses=device.glyph_cache_misses)
+        device.glyph_cache_hits = device.glyph_cache_misses = 0
+        yield device.current_page
+
+
+def extract_textboxes(f: PDFFileDescriptor, pagenos: Optional[Container[int]] = None) -> PdfOfTextBoxes:
+    return PdfOfTextBoxes(list(iterate_textboxes(f, pagenos)))
+
+
+def count_pages(f: PDFFileDescriptor) -> int:
+    f.fp.seek(0)
+    result = sum(1 for _ in PDFPage.get_pages(f.fp))
+    f.fp.seek(0)
+    return result
+
+
+def split_to_page_chunks(pagenos: Sequence[int], workers: int) -> List[Tuple[int, ...]]:
+    # Using more chunks than workers, because pages are not equally expensive,
+    # and this way the workers finish at roughly the same time.
+    chunk_size = max(MIN_PAGES_PER_CHUNK, -(-len(pagenos) // (workers * 4)))
+    return [tuple(pagenos[start:start + chunk_size]) for start in range(0, len(pagenos), chunk_size)]
+
 
+# Needed instead of a lambda for the same reason as _DoExtractionWrapper in all.py:
+# multiprocessing can only send picklable callables to its workers.
+class _PageRangeExtractor:
+    def __init__(self, filename: str, cache_id: str):
+        self.filename = filename
+        self.cache_id = cache_id
 
-def sort_textboxes_into_dicts(textboxes: Iterable[TextBox]) -> Dict[float, Dict[float, TextBox]]:
-    textboxes_as_dicts: Dict[float, Dict[float, TextBox]] = {}
-    for tb in textboxes:
-        if tb.y not in textboxes_as_dicts:
+    def __call__(self, pagenos: Tuple[int, ...]) -> Tuple[List[PageOfLines], Dict[str, StageMetrics]]:
+        f = PDFFileDescriptor(self.filename, self.cache_id)
+        try:
+            return list(iterate_lines(f, set(pagenos))), take_metrics()
+        finally:
+            f.fp.close()
+
+
+def can_use_page_workers() -> bool:
+    # Daemonic processes (e.g. the workers of do_extraction) are not allowed
+    # to have children.
+    return page_workers > 1 and not multiprocessing.current_process().daemon
+
+
+def extract_pages(f: PDFFileDescriptor, pagenos: Sequence[int]) -> Iterable[PageOfLines]:
+    """Interprets the requested pages, in parallel if page workers are enabled. Pages are returned in order."""
+    if can_use_page_workers():
+        chunks = split_to_page_chunks(pagenos, page_workers)
+        if len(chunks) > 1:
+            with multiprocessing.Pool(min(page_workers, len(chunks)), initializer=reset_metrics) as pool:
+                # imap keeps the order of the chunks, so pages are reassembled in the correct order.
+                for pages, metrics in pool.imap(_PageRangeExtractor(f.filename, f.cache_id), chunks):
+                    merge_metrics(metrics)
+                    yield from pages
+            return
+    yield from iterate_lines(f, set(pagenos))
+
+
+def to_ranges(numbers: Iterable[int]) -> List[Tuple[int, int]]:
+    result: List[Tuple[int, int]] = []
+    for number in sorted(numbers):
+        if result and result[-1][1] == number:
+            result[-1] = (result[-1][0], number + 1)
+        else:
+            result.append((number, number + 1))
+    return result
+
+
+def extract_pdf(f: PDFFileDescriptor) -> PdfOfLines:
+    page_count = count_pages(f)
+    result = PdfOfLines()
+    if f.page_selector is None:
+        for page in extract_pages(f, range(page_count)):
+            result.add_page(page)
+        return result
+
+    # Interpret pages one by one, until the selector knows which pages are needed.
+    selected_pagenos = None
+    for page in iterate_lines(f):
+        result.add_page(page)
+        selected_pagenos = f.page_selector(result.pages, page_count)
+        if selected_pagenos is not None:
+            break
+    if selected_pagenos is None:
+        # Everything was interpreted anyway
+        return result
+
+    first_unprocessed = len(result.pages)
+    pagenos_to_interpret = sorted(p for p in set(selected_pagenos) if first_unprocessed <= p < page_count)
+    interpreted_pages = dict(zip(pagenos_to_interpret, extract_pages(f, pagenos_to_interpret)))
+    for pageno in range(first_unprocessed, page_count):
+        result.add_page(interpreted_pages.get(pageno, PageOfLines()))
+    result.skipped_page_ranges = to_ranges(p for p in range(first_unprocessed, page_count) if p not in interpreted_pages)
+    return result
+
+
+def sort_textboxes_into_dicts(page: PageOfTextBoxes) -> Dict[float, Dict[float, int]]:
+    """Returns the indexes of the textboxes of the page, by y and x coordinates"""
+    xs = page.x
+    ys = page.y
+    content_ids = page.content_id
+    textboxes_as_dicts: Dict[float, Dict[float, int]] = {}
+    for index in range(len(page)):
+        y = ys[index]
+        x = xs[index]
+        if y not in textboxes_as_dicts:
             # TODO: quantize y if needed. We are only lucky that
             # lines don't have an epsilon amount of y space between words
             # And that sub and superscripts are not used
-            textboxes_as_dicts[tb.y] = {}
-        if tb.x in textboxes_as_dicts[tb.y]:
-            if tb.content != textboxes_as_dicts[tb.y][tb.x].content:
+            textboxes_as_dicts[y] = {}
+        if x in textboxes_as_dicts[y]:
+            if content_ids[index] != content_ids[textboxes_as_dicts[y][x]]:
                 raise ValueError(
                     "Multiple textboxes on the exact same coordinates"
                     "(Already there: '{}', to-be-inserted: '{}')"
-                    .format(textboxes_as_dicts[tb.y][tb.x], tb.content)
+                    .format(page.textbox(textboxes_as_dicts[y][x]), page.content(index))
                 )
         else:
-            textboxes_as_dicts[tb.y][tb.x] = tb
+            textboxes_as_dicts[y][x] = index
 
     # Consolidate boxes into lines, i.e. try to put characters
     # from the same line to the same "y" bucket.
@@ -204,57 +473,166 @@ def sort_textboxes_into_dicts(textboxes: Iterable[TextBox]) -> Dict[float, Dict[
     return textboxes_as_dicts
 
 
-def convert_textbox_dict_to_line(textbox_dict: Dict[float, TextBox], rightmost_on_page: float) -> IndentedLine:
+def convert_textboxes_to_line(
+        page: PageOfTextBoxes,
+        indexes: Iterable[int],
+        rightmost_on_page: float,
+        interner: IndentedLinePartInterner
+) -> IndentedLine:
+    # pylint: disable=too-many-locals
+    # Local variables instead of attribute lookups, as this is a hot loop.
+    make_part = interner.get
+    xs = page.x
+    widths = page.width
+    widths_of_space = page.width_of_space
+    bolds = page.bold
+    content_ids = page.content_id
+    contents = page.contents
     parts = []
     threshold_to_space = None
     prev_x = 0.0
     margin_right = 0.0
-    for x in sorted(textbox_dict):
-        box = textbox_dict[x]
-        if threshold_to_space is not None and (x > threshold_to_space or box.content == '„'):
+    for index in indexes:
+        x = xs[index]
+        width = widths[index]
+        content = contents[content_ids[index]]
+        if threshold_to_space is not None and (x > threshold_to_space or content == '„'):
             if parts and parts[-1].content[-1] != ' ':
-                parts.append(IndentedLinePart(threshold_to_space - prev_x, ' '))
+                parts.append(make_part(threshold_to_space - prev_x, ' '))
                 prev_x = threshold_to_space
-        parts.append(IndentedLinePart(box.x - prev_x, box.content, box.bold))
-        prev_x = box.x
-        threshold_to_space = x + box.width + box.width_of_space * 0.5
-        margin_right = rightmost_on_page - (box.x - box.width)
+        parts.append(make_part(x - prev_x, content, bolds[index] != 0))
+        prev_x = x
+        threshold_to_space = x + width + widths_of_space[index] * 0.5
+        margin_right = rightmost_on_page - (x - width)
 
     return IndentedLine(tuple(parts), margin_right)
 
 
-def extract_single_page(page: PageOfTextBoxes) -> PageOfLines:
+def extract_single_page(page: PageOfTextBoxes, interner: Optional[IndentedLinePartInterner] = None) -> PageOfLines:
+    if interner is None:
+        interner = IndentedLinePartInterner()
     processed_page = PageOfLines()
-    textboxes_as_dicts = sort_textboxes_into_dicts(page.textboxes)
-    rightmost_on_page = max(tb.width + tb.x for tb in page.textboxes)
+    rightmost_on_page = max(map(operator.add, page.width, page.x))
     prev_y = 0.0
+    textboxes_as_dicts = sort_textboxes_into_dicts(page)
     for y in sorted(textboxes_as_dicts, reverse=True):
         # TODO: don't hardcode the 18, but use actual textbox dimensions
         if prev_y != 0 and (prev_y - y) > 18:
             processed_page.add_line(EMPTY_LINE)
         prev_y = y
-        processed_page.add_line(convert_textbox_dict_to_line(textboxes_as_dicts[y], rightmost_on_page))
+        line = textboxes_as_dicts[y]
+        processed_page.add_line(convert_textboxes_to_line(page, (line[x] for x in sorted(line)), rightmost_on_page, interner))
     return processed_page
 
 
 def extract_lines(potb: PdfOfTextBoxes) -> PdfOfLines:
     result = PdfOfLines()
+    interner = IndentedLinePartInterner()
     for page in potb.pages:
-        result.add_page(extract_single_page(page))
+        result.add_page(extract_single_page(page, interner))
     return result
 
 
+def iterate_lines(f: PDFFileDescriptor, pagenos: Optional[Container[int]] = None) -> Iterable[PageOfLines]:
+    # Streaming version of extract_lines(extract_textboxes(f)): the textboxes of
+    # a page are thrown away as soon as they are converted to lines.
+    # Parts are interned for the whole document, not just per page.
+    interner = IndentedLinePartInterner()
+    for page in iterate_textboxes(f, pagenos):
+        hits_before, saved_bytes_before = interner.hits, interner.saved_bytes
+        lines = extract_single_page(page, interner)
+        update_interner_metrics(interner, hits_before, saved_bytes_before)
+        yield lines
+
+
 PDF_OF_LINES_CONVERTER = dict2object.get_converter(PdfOfLines)
 
 
+def pdf_of_lines_to_bytes(pdf: PdfOfLines) -> bytes:
+    return binary_format.encode((page.lines for page in pdf.pages), pdf.skipped_page_ranges)
+
+
+def pdf_of_lines_from_bytes(data: binary_format.Buffer) -> PdfOfLines:
+    # Pages are only decoded when they are first accessed, so that
+    # extracting only a part of a huge document is fast.
+    decoder = binary_format.Decoder(data)
+    return PdfOfLines(LazyPageList(decoder), list(decoder.skipped_page_ranges))
+
+
+# Pages of the binary format are decoded lazily, and the format itself is not compressed
+BINARY_DECODED_SIZE_FACTOR = 4.0
+
+
+def get_pdf_version() -> str:
+    return str(pdfminer.__version__)
+
+
+PDF_CACHE_STAGE = CacheStage(
+    'parsed',
+    ('hun_law.extractors.pdf', 'hun_law.binary_format', 'hun_law.utils', 'hun_law.dict2object'),
+    (get_pdf_version, ),
+)
+
+
+def get_pdf_cache_key(f: PDFFileDescriptor, with_page_selector: bool) -> str:
+    extra_inputs = []
+    if with_page_selector and f.page_selector is not None:
+        extra_inputs.append(hash_function(f.page_selector))
+        extra_inputs.append(hash_modules(f.page_selector.__module__))
+    return PDF_CACHE_STAGE.cache_key(f.cache_id, hash_file(f.filename), *extra_inputs)
+
+
+def read_cached_pdf(cache_key: str) -> Optional[PdfOfLines]:
+    binary_cache_object = CacheObject(cache_key + ".bin")
+    json_cache_object = CacheObject(cache_key + ".gz")
+    if cache_format == 'binary' and binary_cache_object.exists():
+        return binary_cache_object.read_decoded(lambda o: pdf_of_lines_from_bytes(o.mmap()), BINARY_DECODED_SIZE_FACTOR)
+    if json_cache_object.exists():
+        result = json_cache_object.read_decoded(lambda o: PDF_OF_LINES_CONVERTER.to_object(o.read_json()))
+        if cache_format == 'binary':
+            # Convert it to the newer format for faster loading next time.
+            binary_cache_object.write_bytes(pdf_of_lines_to_bytes(result))
+        return result
+    return None
+
+
+def read_first_cached_pdf(cache_keys: Iterable[str]) -> Optional[PdfOfLines]:
+    for cache_key in cache_keys:
+        result = read_cached_pdf(cache_key)
+        if result is not None:
+            return result
+    return None
+
+
+def write_cached_pdf(cache_key: str, pdf: PdfOfLines) -> None:
+    if cache_format == 'binary':
+        cache_object = CacheObject(cache_key + ".bin")
+        cache_object.write_bytes(pdf_of_lines_to_bytes(pdf))
+        cache_object.remember_decoded(pdf, BINARY_DECODED_SIZE_FACTOR)
+    else:
+        cache_object = CacheObject(cache_key + ".gz")
+        cache_object.write_json(PDF_OF_LINES_CONVERTER.to_dict(pdf))
+        cache_object.remember_decoded(pdf)
+
+
 @Extractor(PDFFileDescriptor)
 def CachedPdfParser(f: PDFFileDescriptor) -> Iterable[PdfOfLines]:
-    cache_object = CacheObject(f.cache_id + ".parsed_v5.gz")
-    if cache_object.exists():
-        result = PDF_OF_LINES_CONVERTER.to_object(cache_object.read_json())
-        yield result
+    full_cache_key = get_pdf_cache_key(f, False)
+    cache_key = get_pdf_cache_key(f, True)
+    # Fully parsed PDFs can be used even if pages could be skipped
+    keys = (cache_key, full_cache_key) if f.page_selector is not None else (full_cache_key, )
+    result = read_first_cached_pdf(keys)
+    if result is None:
+        with CacheObject(cache_key).lock():
+            # Check again, it might have been parsed by someone else while waiting for the lock
+            result = read_first_cached_pdf(keys)
+            if result is None:
+                with measure_time(PDF_CACHE_STAGE.name, 'compute_time'):
+                    result = extract_pdf(f)
+                update_metrics(PDF_CACHE_STAGE.name, misses=1)
+                write_cached_pdf(cache_key if result.skipped_page_ranges else full_cache_key, result)
+            else:
+                update_metrics(PDF_CACHE_STAGE.name, hits=1)
     else:
-        textboxes = extract_textboxes(f)
-        result = extract_lines(textboxes)
-        cache_object.write_json(PDF_OF_LINES_CONVERTER.to_dict(result))
-        yield result
+        update_metrics(PDF_CACHE_STAGE.name, hits=1)
+    yield result
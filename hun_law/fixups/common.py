@@ -22,6 +22,7 @@ import re
 from typing import Dict, Callable, List, Optional, Sequence, Iterable
 
 from hun_law.utils import IndentedLine, IndentedLinePart, EMPTY_LINE
+from hun_law.cache_keys import hash_function, hash_strings
 
 FixupFn = Callable[[Iterable[IndentedLine]], Iterable[IndentedLine]]
 all_fixups: Dict[str, List[FixupFn]] = {}
@@ -49,6 +50,11 @@ def do_all_fixups(law_id: str, body: Iterable[IndentedLine]) -> Iterable[Indente
     return body
 
 
+def fixups_fingerprint(law_id: str) -> str:
+    """Identifies the fixups of a law, so that cached results can be invalidated when they change."""
+    return hash_strings(*(hash_function(fixup) for fixup in all_fixups.get(law_id, ())))
+
+
 def add_empty_line_after(needle: str) -> FixupFn:
     def empty_line_adder(body: Iterable[IndentedLine]) -> Iterable[IndentedLine]:
         result = []
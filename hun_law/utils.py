@@ -15,7 +15,9 @@
 # You should have received a copy of the GNU General Public License
 # along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
 
+import bisect
 import collections
+import sys
 import textwrap
 import datetime
 import re
@@ -32,6 +34,44 @@ class IndentedLinePart:
     bold: bool = False
 
 
+class IndentedLinePartInterner:
+    """Flyweight factory for IndentedLineParts.
+
+    Most parts are a single character, and since dx is relative to the previous
+    part, the exact same (dx, content, bold) combination occurs a lot in a
+    document. These are returned as the same (immutable) object, and identical
+    content strings are shared too.
+    Meant to be used for a single document, so that the tables don't grow forever.
+    """
+
+    PART_SIZE = sys.getsizeof(IndentedLinePart(0.0, ''))
+
+    def __init__(self) -> None:
+        self.parts: Dict[Tuple[float, str, bool], IndentedLinePart] = {}
+        self.contents: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+        # Estimated memory saved compared to creating a new object for every part.
+        self.saved_bytes = 0
+
+    def get(self, dx: float, content: str, bold: bool = False) -> IndentedLinePart:
+        key = (dx, content, bold)
+        result = self.parts.get(key)
+        if result is not None:
+            self.hits += 1
+            self.saved_bytes += self.PART_SIZE
+            if result.content is not content:
+                self.saved_bytes += sys.getsizeof(content)
+            return result
+        self.misses += 1
+        interned_content = self.contents.setdefault(content, content)
+        if interned_content is not content:
+            self.saved_bytes += sys.getsizeof(content)
+        result = IndentedLinePart(dx, interned_content, bold)
+        self.parts[key] = result
+        return result
+
+
 @attr.s(slots=True, frozen=True)
 class IndentedLine:
     _parts: Tuple[IndentedLinePart, ...] = attr.ib(factory=tuple)
@@ -39,6 +79,10 @@ class IndentedLine:
     content: str = attr.ib(init=False)
     indent: float = attr.ib(init=False)
     bold: bool = attr.ib(init=False)
+    # Cumulative character and x offsets at the start of every part (plus the end),
+    # used for slicing. Computed lazily, because most lines are never sliced.
+    _char_offsets: Optional[List[int]] = attr.ib(init=False, default=None, eq=False, hash=False, repr=False)
+    _x_offsets: Optional[List[float]] = attr.ib(init=False, default=None, eq=False, hash=False, repr=False)
 
     @_parts.validator
     def _parts_validator(self, _attribute: Any, parts: Tuple[IndentedLinePart, ...]) -> None:
@@ -67,6 +111,23 @@ class IndentedLine:
                 bold_len += len(p.content)
         return bold_len * 2 > sum_len
 
+    @property
+    def parts(self) -> Tuple[IndentedLinePart, ...]:
+        return self._parts
+
+    def _get_offsets(self) -> Tuple[List[int], List[float]]:
+        if self._char_offsets is None or self._x_offsets is None:
+            char_offsets = [0]
+            x_offsets = [0.0]
+            for part in self._parts:
+                char_offsets.append(char_offsets[-1] + len(part.content))
+                x_offsets.append(x_offsets[-1] + part.dx)
+            # This is a cache, so modifying the frozen instance is fine.
+            object.__setattr__(self, '_char_offsets', char_offsets)
+            object.__setattr__(self, '_x_offsets', x_offsets)
+            return char_offsets, x_offsets
+        return self._char_offsets, self._x_offsets
+
     def slice(self, start: int, end: Optional[int] = None) -> 'IndentedLine':
         if start < 0:
             start = len(self.content) + start
@@ -81,29 +142,22 @@ class IndentedLine:
         if end <= start:
             return EMPTY_LINE
 
-        skipped_x = 0.0
-        skipped_len = 0
-        skipped_parts_index = 0
-        while skipped_len < start and skipped_parts_index < len(self._parts):
-            skipped_x += self._parts[skipped_parts_index].dx
-            skipped_len += len(self._parts[skipped_parts_index].content)
-            skipped_parts_index += 1
+        char_offsets, x_offsets = self._get_offsets()
+        # First part that does not end before start
+        skipped_parts_index = bisect.bisect_left(char_offsets, start, 0, len(self._parts))
         if skipped_parts_index >= len(self._parts):
             return EMPTY_LINE
-        if skipped_len != start:
+        if char_offsets[skipped_parts_index] != start:
             offending_part = self._parts[skipped_parts_index-1].content
             raise ValueError(
                 "Couldn't slice precisely at requested start index (multi-char part '{}' in the way)"
                 .format(offending_part)
             )
+        skipped_x = x_offsets[skipped_parts_index]
 
-        included_parts_index = skipped_parts_index
-        included_len = 0
-        while included_len < end-start and included_parts_index < len(self._parts):
-            included_len += len(self._parts[included_parts_index].content)
-            included_parts_index += 1
-
-        if included_len != end-start:
+        # First part that does not end before end
+        included_parts_index = bisect.bisect_left(char_offsets, end, skipped_parts_index + 1, len(self._parts))
+        if char_offsets[included_parts_index] != end:
             offending_part = self._parts[included_parts_index-1].content
             raise ValueError(
                 "Couldn't slice precisely at requested end index (multi-char part '{}' in the way)"
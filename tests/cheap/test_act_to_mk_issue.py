@@ -0,0 +1,50 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+from typing import Any
+
+from hun_law.act_to_mk_issue import ActInIssue, load_act_to_mk_issue, find_issue_of_act, select_issues
+from hun_law.cache import CacheObject, init_cache
+
+
+def test_load_act_to_mk_issue() -> None:
+    acts = load_act_to_mk_issue()
+    assert len(acts) > 2000
+    assert acts[0] == ActInIssue(
+        2009, 23, '2009. évi I. törvény',
+        'A Magyar Honvédség hivatásos és szerződéses állományú katonáinak jogállásáról szóló 2001. évi XCV. törvény módosításáról'
+    )
+    assert find_issue_of_act('2013. évi V. törvény', acts) == (2013, 31)
+    assert find_issue_of_act('2013. évi MMM. törvény', acts) is None
+
+
+def test_select_issues(tmpdir: Any) -> None:
+    init_cache(str(tmpdir))
+    acts = [
+        ActInIssue(2010, 1, '2010. évi I. törvény', ''),
+        ActInIssue(2010, 2, '2010. évi II. törvény', ''),
+        ActInIssue(2010, 2, '2010. évi III. törvény', ''),
+        ActInIssue(2011, 5, '2011. évi I. törvény', ''),
+        ActInIssue(2012, 1, '2012. évi I. törvény', ''),
+    ]
+    assert select_issues(acts) == [(2010, 2), (2010, 1), (2011, 5), (2012, 1)]
+    assert select_issues(acts, from_year=2011) == [(2011, 5), (2012, 1)]
+    assert select_issues(acts, to_year=2011) == [(2010, 2), (2010, 1), (2011, 5)]
+    assert select_issues(acts, act_identifiers=('2010. évi III. törvény', '2012. évi I. törvény')) == [(2010, 2), (2012, 1)]
+
+    # Size of already downloaded issues is used as the cost
+    CacheObject('MK/2012/1.pdf').write_bytes(b'x' * 10000000)
+    assert select_issues(acts) == [(2012, 1), (2010, 2), (2010, 1), (2011, 5)]
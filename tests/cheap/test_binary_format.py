@@ -0,0 +1,71 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+import pickle
+from typing import Any
+
+from hun_law.utils import IndentedLine, IndentedLinePart, EMPTY_LINE
+from hun_law.cache import CacheObject, init_cache
+from hun_law.cache_metrics import get_metrics, reset_metrics
+from hun_law.extractors.pdf import PdfOfLines, PageOfLines, PDF_CACHE_STAGE, pdf_of_lines_to_bytes, pdf_of_lines_from_bytes
+from hun_law import binary_format
+
+
+def get_test_pdf() -> PdfOfLines:
+    pages = []
+    for page_num in range(5):
+        page = PageOfLines()
+        page.add_line(IndentedLine((IndentedLinePart(10, 'Page'), IndentedLinePart(5, ' '), IndentedLinePart(7.25, str(page_num), True)), 12.5))
+        page.add_line(EMPTY_LINE)
+        page.add_line(IndentedLine((IndentedLinePart(20, 'ffi'), IndentedLinePart(3, 'ő')), 1.0))
+        pages.append(page)
+    return PdfOfLines(pages, [(3, 4)])
+
+
+def test_binary_format_roundtrip() -> None:
+    pdf = get_test_pdf()
+    decoded = binary_format.decode(pdf_of_lines_to_bytes(pdf))
+    assert decoded.skipped_page_ranges == ((3, 4),)
+    assert [list(page) for page in decoded.pages] == [page.lines for page in pdf.pages]
+    assert decoded.pages[0][0].parts[2].bold
+    assert decoded.pages[0][0].margin_right == 12.5
+
+
+def test_lazy_pages(tmpdir: Any) -> None:
+    pdf = get_test_pdf()
+    init_cache(str(tmpdir))
+    cache_object = CacheObject("lazy_test.bin")
+    cache_object.write_bytes(pdf_of_lines_to_bytes(pdf))
+
+    reset_metrics()
+    lazy_pdf = pdf_of_lines_from_bytes(cache_object.mmap())
+    assert lazy_pdf.skipped_page_ranges == [(3, 4)]
+    assert len(lazy_pdf.pages) == 5
+    assert lazy_pdf.pages[4] == pdf.pages[4]
+    assert lazy_pdf.pages[-1] is lazy_pdf.pages[4], "Pages are decoded only once"
+    assert lazy_pdf.pages[1:3] == pdf.pages[1:3]
+    assert list(lazy_pdf.pages) == pdf.pages
+    assert lazy_pdf == pdf
+    assert pdf == lazy_pdf
+    assert lazy_pdf != PdfOfLines(pdf.pages[:4], [(3, 4)])
+    metrics = get_metrics()[PDF_CACHE_STAGE.name]
+    # Every page has 4 parts that are the same as on the first decoded page
+    assert metrics.interned_parts == 16
+    assert metrics.interner_saved_bytes > 0
+
+    # The cache can be overwritten while the old version is still mapped
+    cache_object.write_bytes(pdf_of_lines_to_bytes(PdfOfLines()))
+    assert pickle.loads(pickle.dumps(lazy_pdf)) == pdf
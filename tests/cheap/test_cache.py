@@ -0,0 +1,315 @@
+# Copyright 2018 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+import errno
+import io
+import json
+import multiprocessing
+import os
+import stat
+import time
+from typing import Any
+
+import pytest
+
+from hun_law import cache
+from hun_law.cache import CacheObject, CACHE_BACKENDS, MemoryCache, init_cache, flush_cache, set_memory_cache_size, \
+    get_default_cache_dirs, list_cache_entries
+from hun_law.cache_keys import CacheStage
+from hun_law.cache_metrics import StageMetrics, get_metrics, merge_metrics, reset_metrics, take_metrics, write_metrics_report
+from hun_law.cache_maintenance import collect_garbage, evict_to_size, get_cache_stats, parse_size
+
+
+def write_in_subprocess(name: str) -> None:
+    CacheObject(name).write_json({'written_by': 'subprocess'})
+    flush_cache()
+
+
+@pytest.mark.parametrize("backend", CACHE_BACKENDS.keys())
+def test_cache_backend(tmpdir: Any, backend: str) -> None:
+    init_cache(str(tmpdir), backend)
+    cache_object = CacheObject('MK/2013/31.pdf.parsed.bin')
+    assert not cache_object.exists()
+    assert cache_object.size_on_disk() == 0
+    cache_object.write_bytes(b'parsed')
+    assert cache_object.exists()
+    assert cache_object.read_bytes() == b'parsed'
+    assert cache_object.mmap()[:] == b'parsed'
+    assert cache_object.size_on_disk() == 6
+    cache_object.sidecar('.manifest.gz').write_json({'size': 6})
+    assert cache_object.sidecar('.manifest.gz').read_json() == {'size': 6}
+
+    # Downloads are written into the file directly
+    downloaded_object = CacheObject('MK/2013/31.pdf')
+    tmpdir.join('MK', '2013', '31.pdf').write_binary(b'downloaded', ensure=True)
+    assert downloaded_object.read_bytes() == b'downloaded'
+    assert [o.name for o in downloaded_object.derived_objects()] == ['MK/2013/31.pdf.parsed.bin', 'MK/2013/31.pdf.parsed.bin.manifest.gz']
+
+    cache_object.delete()
+    assert not cache_object.exists()
+    assert [o.name for o in downloaded_object.derived_objects()] == ['MK/2013/31.pdf.parsed.bin.manifest.gz']
+
+    # Everything is persisted
+    flush_cache()
+    init_cache(str(tmpdir), backend)
+    assert not cache_object.exists()
+    assert cache_object.sidecar('.manifest.gz').read_json() == {'size': 6}
+
+    process = multiprocessing.get_context('fork').Process(target=write_in_subprocess, args=('from_subprocess.gz', ))
+    process.start()
+    process.join()
+    assert CacheObject('from_subprocess.gz').read_json() == {'written_by': 'subprocess'}
+
+
+def compute_with_lock(name: str, log_filename: str) -> None:
+    cache_object = CacheObject(name)
+    with cache_object.lock():
+        if not cache_object.exists():
+            with open(log_filename, 'a', encoding='utf-8') as log:
+                log.write('computed\n')
+            time.sleep(0.2)
+            cache_object.write_bytes(b'result')
+    assert cache_object.read_bytes() == b'result'
+
+
+@pytest.mark.parametrize("backend", CACHE_BACKENDS.keys())
+def test_concurrent_computation(tmpdir: Any, backend: str) -> None:
+    init_cache(str(tmpdir), backend)
+    log_filename = str(tmpdir.join('log.txt'))
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=compute_with_lock, args=('locked_entry', log_filename)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert tmpdir.join('log.txt').read() == 'computed\n', "Only one process computes the entry"
+    assert CacheObject('locked_entry').read_bytes() == b'result'
+
+
+def test_atomic_write(tmpdir: Any) -> None:
+    init_cache(str(tmpdir))
+    cache_object = CacheObject('MK/2013/31.pdf.parsed.bin')
+    cache_object.write_bytes(b'old')
+    old_data = cache_object.mmap()
+    cache_object.write_bytes(b'new')
+    assert old_data[:] == b'old', "Readers of the old version are not affected"
+    assert cache_object.read_bytes() == b'new'
+    assert os.listdir(str(tmpdir.join('MK', '2013'))) == ['31.pdf.parsed.bin'], "No temporary files are left behind"
+
+
+def test_file_permissions(tmpdir: Any) -> None:
+    init_cache(str(tmpdir))
+    old_umask = os.umask(0o022)
+    try:
+        cache_object = CacheObject('MK/2013/31.pdf.parsed.bin')
+        cache_object.write_bytes(b'data')
+        with cache_object.lock():
+            pass
+    finally:
+        os.umask(old_umask)
+    assert stat.S_IMODE(os.stat(cache_object.get_filename()).st_mode) == 0o644, "Other users can read the cache"
+    lock_filename = str(tmpdir.join('.locks', 'MK', '2013', '31.pdf.parsed.bin.lock'))
+    assert stat.S_IMODE(os.stat(lock_filename).st_mode) == 0o644
+
+
+@pytest.mark.parametrize("backend", CACHE_BACKENDS.keys())
+def test_garbage_collection(tmpdir: Any, backend: str) -> None:
+    init_cache(str(tmpdir), backend)
+    stage = CacheStage('gc_test', ('hun_law.cache_keys', ))
+    current_entry = CacheObject(stage.cache_key('MK/2013/31.pdf', 'abcd') + '.bin')
+    current_entry.write_bytes(b'current')
+    outdated_entry = CacheObject('MK/2013/31.pdf.gc_test.0123456789abcdef.0123456789abcdef.bin')
+    outdated_entry.write_bytes(b'outdated')
+    legacy_entry = CacheObject('MK/2013/31.pdf.parsed_v5.gz')
+    legacy_entry.write_bytes(b'legacy')
+    orphan_manifest = CacheObject('MK/2013/32.pdf.manifest.gz')
+    orphan_manifest.write_bytes(b'orphan')
+    tmpdir.join('MK', '2013', '31.pdf').write_binary(b'downloaded', ensure=True)
+
+    assert sorted(e.name for e in collect_garbage(dry_run=True)) == sorted(e.name for e in collect_garbage())
+    assert current_entry.exists()
+    assert CacheObject('MK/2013/31.pdf').exists()
+    assert not outdated_entry.exists()
+    assert not legacy_entry.exists()
+    assert not orphan_manifest.exists()
+    stats = get_cache_stats()
+    assert stats['gc_test'].size == len(b'current')
+    assert stats['source'].size == len(b'downloaded')
+
+
+@pytest.mark.parametrize("backend", CACHE_BACKENDS.keys())
+def test_eviction(tmpdir: Any, backend: str) -> None:
+    init_cache(str(tmpdir), backend)
+    stage = CacheStage('eviction_test', ('hun_law.cache_keys', ))
+    tmpdir.join('MK', '2013', '31.pdf').write_binary(b'x' * 1000, ensure=True)
+    CacheObject('MK/2013/31.pdf.manifest.gz').write_bytes(b'x' * 10)
+    derived_entries = [CacheObject(stage.cache_key('MK/2013/31.pdf', str(i))) for i in range(3)]
+    for entry in derived_entries:
+        entry.write_bytes(b'x' * 100)
+    flush_cache()
+    os.utime(tmpdir.join('MK', '2013', '31.pdf'), (0, 0))
+    derived_entries[1].read_bytes()
+    flush_cache()
+
+    assert not evict_to_size(10000)
+    evicted = evict_to_size(1200)
+    assert {e.name for e in evicted} == {derived_entries[0].name, derived_entries[2].name}, "Least recently used derived entries are evicted"
+    assert derived_entries[1].exists()
+
+    evict_to_size(1000)
+    assert not CacheObject('MK/2013/31.pdf').exists()
+    assert not CacheObject('MK/2013/31.pdf.manifest.gz').exists(), "Manifests are removed with their files"
+
+
+def test_parse_size() -> None:
+    assert parse_size('1000') == 1000
+    assert parse_size('20G') == 20 * 1024 ** 3
+    assert parse_size('1.5k') == 1536
+
+
+def test_memory_cache() -> None:
+    memory_cache = MemoryCache(100)
+    memory_cache.put('a', 'decoded a', 50)
+    memory_cache.put('b', 'decoded b', 40)
+    assert memory_cache.get('a') == (True, 'decoded a')
+    memory_cache.put('c', 'decoded c', 30)
+    assert memory_cache.get('b') == (False, None), "Least recently used entry is evicted"
+    assert memory_cache.get('c') == (True, 'decoded c')
+    memory_cache.put('d', 'too big', 101)
+    assert memory_cache.get('d') == (False, None)
+    assert (memory_cache.hits, memory_cache.misses, memory_cache.evictions) == (2, 2, 1)
+    assert memory_cache.size == 80
+
+
+def test_read_decoded(tmpdir: Any) -> None:
+    init_cache(str(tmpdir))
+    decode_count = 0
+
+    def decode(cache_object: CacheObject) -> Any:
+        nonlocal decode_count
+        decode_count += 1
+        return cache_object.read_json()
+
+    cache_object = CacheObject('decoded.gz')
+    cache_object.write_json({'a': 1})
+    try:
+        assert cache_object.read_decoded(decode) == {'a': 1}
+        assert cache_object.read_decoded(decode) == {'a': 1}
+        assert decode_count == 2, "Memory cache is disabled by default"
+
+        set_memory_cache_size(1024 * 1024)
+        assert cache_object.read_decoded(decode) is cache_object.read_decoded(decode)
+        assert decode_count == 3
+        cache_object.write_json({'a': 2})
+        assert cache_object.read_decoded(decode) == {'a': 2}, "Written entries are not served from memory"
+        assert cache.memory_cache is not None and cache.memory_cache.hits == 1
+    finally:
+        set_memory_cache_size(0)
+
+
+def test_metrics(tmpdir: Any) -> None:
+    init_cache(str(tmpdir))
+    reset_metrics()
+    stage = CacheStage('metrics_test', ('hun_law.cache_keys', ))
+    cache_object = CacheObject(stage.cache_key('MK/2013/31.pdf', 'abcd') + '.gz')
+    cache_object.write_json({'a': 1})
+    cache_object.read_decoded(lambda o: o.read_json())
+    metrics = take_metrics()
+    assert metrics['metrics_test'].bytes_written == metrics['metrics_test'].bytes_read == cache_object.size_on_disk()
+    assert metrics['metrics_test'].decode_time > 0
+    assert get_metrics() == {}
+
+    merge_metrics({'metrics_test': StageMetrics(hits=3, misses=1, compute_time=2.0, decode_time=0.5)})
+    merge_metrics({'metrics_test': StageMetrics(hits=1, misses=1, compute_time=2.0, decode_time=0.5)})
+    # 4 hits, each would have taken 2 seconds to compute, minus the time spent decoding
+    assert get_metrics()['metrics_test'].compute_time_saved == 7.0
+    report = io.StringIO()
+    write_metrics_report(report)
+    assert json.loads(report.getvalue())['metrics_test']['hits'] == 4
+    reset_metrics()
+
+
+@pytest.mark.parametrize("backend", CACHE_BACKENDS.keys())
+def test_layered_cache(tmpdir: Any, backend: str) -> None:
+    shared_dirs = [str(tmpdir.join('shared_files')), str(tmpdir.join('shared_db'))]
+    init_cache(shared_dirs[0])
+    CacheObject('both.gz').write_json('from shared files')
+    CacheObject('files_only.gz').write_json('from shared files')
+    tmpdir.join('shared_files', 'MK', '2013', '31.pdf').write_binary(b'shared download', ensure=True)
+    init_cache(shared_dirs[1], 'sqlite')
+    CacheObject('both.gz').write_json('from shared db')
+    CacheObject('db_only.gz').write_json('from shared db')
+    flush_cache()
+
+    init_cache(str(tmpdir.join('local')), backend, shared_dirs)
+    assert CacheObject('both.gz').read_json() == 'from shared files', "Layers are searched in order"
+    assert CacheObject('db_only.gz').read_json() == 'from shared db'
+    assert CacheObject('MK/2013/31.pdf').get_filename() == str(tmpdir.join('shared_files', 'MK', '2013', '31.pdf'))
+    assert CacheObject('MK/2013/31.pdf').get_writable_filename() == str(tmpdir.join('local', 'MK', '2013', '31.pdf'))
+    assert [o.name for o in CacheObject('MK/2013/31.pdf').derived_objects()] == []
+
+    CacheObject('both.gz').write_json('local')
+    assert CacheObject('both.gz').read_json() == 'local', "Writes go to the writable layer"
+    CacheObject('both.gz').delete()
+    assert CacheObject('both.gz').read_json() == 'from shared files', "Deleting only affects the writable layer"
+    CacheObject('new.gz').write_json('local')
+    flush_cache()
+    assert [e.name for e in list_cache_entries()] == ['new.gz'], "Read-only layers are not listed"
+    assert not tmpdir.join('shared_files', 'new.gz').exists()
+
+
+def test_read_only_layer_without_write_permission(tmpdir: Any, monkeypatch: Any) -> None:
+    shared_dirs = [str(tmpdir.join('shared_files')), str(tmpdir.join('shared_db'))]
+    init_cache(shared_dirs[0])
+    CacheObject('files.gz').write_json('from shared files')
+    init_cache(shared_dirs[1], 'sqlite')
+    CacheObject('db.gz').write_json('from shared db')
+    flush_cache()
+    # Like at the end of the process that created the shared cache: closing the
+    # last connection moves the contents of the WAL file into the database.
+    assert isinstance(cache.cache_backend, cache.SqliteCacheBackend) and cache.cache_backend.connection is not None
+    cache.cache_backend.connection.close()
+
+    def read_only_filesystem(*_args: Any, **_kwargs: Any) -> None:
+        raise OSError(errno.EROFS, "Read-only file system")
+    real_access = os.access
+    # Running as root would ignore the permissions below, so a read-only mount is simulated too.
+    monkeypatch.setattr(os, 'utime', read_only_filesystem)
+    monkeypatch.setattr(os, 'access', lambda path, mode: real_access(path, mode) and not (mode == os.W_OK and str(path) in shared_dirs))
+    for path in tmpdir.visit(lambda p: str(p).startswith(tuple(shared_dirs))):
+        path.chmod(0o555 if path.isdir() else 0o444)
+    for shared_dir in shared_dirs:
+        tmpdir.join(os.path.basename(shared_dir)).chmod(0o555)
+    try:
+        init_cache(str(tmpdir.join('local')), 'filesystem', shared_dirs)
+        assert CacheObject('files.gz').read_json() == 'from shared files'
+        assert CacheObject('db.gz').read_json() == 'from shared db'
+    finally:
+        monkeypatch.undo()
+        for path in tmpdir.visit():
+            path.chmod(0o755 if path.isdir() else 0o644)
+        for shared_dir in shared_dirs:
+            tmpdir.join(os.path.basename(shared_dir)).chmod(0o755)
+
+
+def test_default_cache_dirs(monkeypatch: Any) -> None:
+    monkeypatch.delenv('HUN_LAW_CACHE_DIR', raising=False)
+    monkeypatch.delenv('HUN_LAW_READ_ONLY_CACHE_DIRS', raising=False)
+    assert get_default_cache_dirs('cache') == ('cache', [])
+    monkeypatch.setenv('HUN_LAW_CACHE_DIR', '/tmp/local_cache')
+    monkeypatch.setenv('HUN_LAW_READ_ONLY_CACHE_DIRS', os.pathsep.join(['/mnt/shared', '/mnt/other']))
+    assert get_default_cache_dirs('cache') == ('/tmp/local_cache', ['/mnt/shared', '/mnt/other'])
@@ -0,0 +1,94 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import json
+import tarfile
+from typing import Any
+
+import pytest
+
+from hun_law.cache import CacheObject, init_cache, CACHE_BACKENDS
+from hun_law.cache_keys import CacheStage
+from hun_law.cache_bundle import EntrySelector, export_bundle, import_bundle, get_year_of_entry
+
+
+BUNDLE_TEST_STAGE = CacheStage('bundle_test', ('hun_law.cache_keys', ))
+
+
+def fill_cache(cache_dir: Any) -> None:
+    init_cache(str(cache_dir))
+    for year in (2012, 2013):
+        cache_dir.join('MK', str(year), '31.pdf').write_binary('pdf of {}'.format(year).encode(), ensure=True)
+        CacheObject('MK/{}/31.pdf.manifest.gz'.format(year)).write_json({'size': 11})
+        CacheObject(BUNDLE_TEST_STAGE.cache_key('MK/{}/31.pdf'.format(year), 'abcd') + '.bin').write_bytes(b'parsed')
+    CacheObject('acts/2013. évi V. törvény.bundle_test.0123456789abcdef.0123456789abcdef.gz').write_bytes(b'outdated')
+
+
+def test_get_year_of_entry() -> None:
+    assert get_year_of_entry('MK/2013/31.pdf') == 2013
+    assert get_year_of_entry('acts/2012. évi V. törvény.act.0123456789abcdef.0123456789abcdef.gz') == 2012
+    assert get_year_of_entry('something_else') is None
+
+
+@pytest.mark.parametrize("backend", CACHE_BACKENDS.keys())
+def test_export_import(tmpdir: Any, backend: str) -> None:
+    fill_cache(tmpdir.join('source_cache'))
+    bundle = str(tmpdir.join('bundle.tar.gz'))
+    assert export_bundle(bundle, EntrySelector(years=[2013])) == 3, "Stale entries and other years are not exported"
+
+    init_cache(str(tmpdir.join('target_cache')), backend)
+    result = import_bundle(bundle)
+    assert (result.imported, result.already_present, result.incompatible, result.corrupt) == (3, 0, 0, 0)
+    assert tmpdir.join('target_cache', 'MK', '2013', '31.pdf').read_binary() == b'pdf of 2013', "Downloads are imported as files"
+    assert CacheObject('MK/2013/31.pdf.manifest.gz').read_json() == {'size': 11}
+    assert CacheObject(BUNDLE_TEST_STAGE.cache_key('MK/2013/31.pdf', 'abcd') + '.bin').read_bytes() == b'parsed'
+    assert not CacheObject('MK/2012/31.pdf').exists()
+
+    result = import_bundle(bundle)
+    assert result.already_present == 3
+
+
+def test_export_by_stage(tmpdir: Any) -> None:
+    fill_cache(tmpdir.join('source_cache'))
+    bundle = str(tmpdir.join('bundle.tar.gz'))
+    assert export_bundle(bundle, EntrySelector(stages=['bundle_test'])) == 2
+    assert export_bundle(bundle, EntrySelector(fingerprints=[BUNDLE_TEST_STAGE.fingerprint()[:16]])) == 2
+    assert export_bundle(bundle, EntrySelector(fingerprints=['0123456789abcdef'])) == 0
+
+
+def test_import_incompatible(tmpdir: Any) -> None:
+    bundle = str(tmpdir.join('bundle.tar.gz'))
+    entries = {
+        'MK/2013/31.pdf.bundle_test.0123456789abcdef.0123456789abcdef.bin': b'other version',
+        '../outside.pdf': b'malicious',
+        'MK/2013/32.pdf': b'corrupt',
+    }
+    manifest = {
+        'format_version': 1,
+        'entries': [{'name': name, 'sha256': '0' * 64 if name == 'MK/2013/32.pdf' else '', 'size': 0} for name in entries],
+    }
+    with tarfile.open(bundle, 'w:gz') as tar:
+        for name, data in [('MANIFEST.json', json.dumps(manifest).encode())] + list(entries.items()):
+            tar_info = tarfile.TarInfo(name)
+            tar_info.size = len(data)
+            tar.addfile(tar_info, io.BytesIO(data))
+
+    init_cache(str(tmpdir.join('cache')))
+    result = import_bundle(bundle)
+    assert (result.imported, result.incompatible, result.corrupt) == (0, 1, 2)
+    assert not tmpdir.join('outside.pdf').exists()
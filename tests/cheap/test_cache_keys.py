@@ -0,0 +1,76 @@
+# Copyright 2018 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import subprocess
+import sys
+from typing import Any, Callable
+
+from hun_law.cache_keys import CacheStage, hash_file, hash_function, hash_strings
+
+
+def test_hash_strings() -> None:
+    assert hash_strings('ab', 'c') != hash_strings('a', 'bc')
+    assert hash_strings('ab', 'c') == hash_strings('ab', 'c')
+
+
+def test_hash_file(tmpdir: Any) -> None:
+    f = tmpdir.join('input.pdf')
+    f.write_binary(b'first')
+    f.setmtime(1000000)
+    first_hash = hash_file(str(f))
+    f.write_binary(b'other')
+    f.setmtime(2000000)
+    assert hash_file(str(f)) != first_hash
+
+
+def make_page_selector(first_page: int) -> Callable[[int], bool]:
+    def page_selector(page: int) -> bool:
+        return page >= first_page
+    return page_selector
+
+
+def test_hash_function() -> None:
+    assert hash_function(make_page_selector(1)) == hash_function(make_page_selector(1))
+    assert hash_function(make_page_selector(1)) != hash_function(make_page_selector(2))
+
+
+def select_test_pages(pages: Any) -> Any:
+    return [p for p in pages if p in {'first', 'second', 'third'}]
+
+
+def test_hash_function_is_stable_between_processes() -> None:
+    # Nested code objects and set constants used to make the hash differ in every process
+    code = (
+        "from tests.cheap.test_cache_keys import select_test_pages, make_page_selector\n"
+        "from hun_law.cache_keys import hash_function\n"
+        "print(hash_function(select_test_pages), hash_function(make_page_selector(3)))\n"
+    )
+    repo_dir = os.path.join(os.path.dirname(__file__), '..', '..')
+    output = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=repo_dir, env=dict(os.environ, PYTHONHASHSEED='12345'), stdout=subprocess.PIPE, check=True, universal_newlines=True,
+    ).stdout
+    assert output.split() == [hash_function(select_test_pages), hash_function(make_page_selector(3))]
+
+
+def test_cache_key() -> None:
+    stage = CacheStage('test_stage', ('hun_law.cache_keys', ))
+    key = stage.cache_key('MK/2013/31.pdf', 'abcd')
+    assert key.startswith('MK/2013/31.pdf.test_stage.')
+    assert key == stage.cache_key('MK/2013/31.pdf', 'abcd')
+    assert key != stage.cache_key('MK/2013/31.pdf', 'abce')
+    assert key != stage.cache_key('MK/2013/31.pdf', 'abcd', 'fixups')
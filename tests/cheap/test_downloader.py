@@ -0,0 +1,223 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+# pylint: disable=redefined-outer-name
+import hashlib
+import http.client
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, Iterator, List, Tuple
+
+import pytest
+
+from hun_law.cache import CacheObject, init_cache
+from hun_law.downloader import Downloader, DownloadError
+from hun_law.extractors import kozlonyok_hu_downloader
+from hun_law.extractors.kozlonyok_hu_downloader import KozlonyToDownload, download_issue
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    files: Dict[str, bytes] = {}
+    # Number of errors to respond with before actually serving a file
+    transient_errors: Dict[str, int] = {}
+    # Number of times the connection is closed in the middle of sending the file
+    interrupted_responses: Dict[str, int] = {}
+    # Paths for which range requests are answered from the wrong offset
+    wrong_ranges: Dict[str, int] = {}
+    requests: List[Tuple[str, Tuple[str, int]]] = []
+    range_requests: List[Tuple[str, str]] = []
+
+    def do_GET(self) -> None:
+        # pylint: disable=invalid-name
+        self.requests.append((self.path, self.client_address))
+        if self.transient_errors.get(self.path, 0) > 0:
+            self.transient_errors[self.path] -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = self.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"{}"'.format(hashlib.sha256(data).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header is not None and (if_range is None or if_range == etag):
+            self.range_requests.append((self.path, range_header))
+            start = int(range_header[len('bytes='):-1])
+            start = self.wrong_ranges.get(self.path, start)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(data) - 1, len(data)))
+            data = data[start:]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        if self.interrupted_responses.get(self.path, 0) > 0:
+            self.interrupted_responses[self.path] -= 1
+            self.wfile.write(data[:len(data) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(data)
+
+    def log_message(self, *args: Any) -> None:
+        # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture
+def mirror_url() -> Iterator[str]:
+    MirrorHandler.files = {
+        '/MK/MK13001.pdf': b'issue 1',
+        '/MK/MK13002.pdf': b'issue 2',
+    }
+    MirrorHandler.transient_errors = {'/MK/MK13002.pdf': 2}
+    MirrorHandler.interrupted_responses = {}
+    MirrorHandler.wrong_ranges = {}
+    MirrorHandler.requests = []
+    MirrorHandler.range_requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MirrorHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:{}/MK/".format(server.server_port)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_downloader(mirror_url: str) -> None:
+    downloader = Downloader(retry_backoff=0.01, min_request_interval=0)
+    assert downloader.fetch(mirror_url + 'MK13001.pdf') == b'issue 1'
+    assert downloader.fetch(mirror_url + 'MK13001.pdf') == b'issue 1'
+    assert len({address for _, address in MirrorHandler.requests}) == 1, "Connection is kept alive"
+
+    assert downloader.fetch(mirror_url + 'MK13002.pdf') == b'issue 2'
+    assert [path for path, _ in MirrorHandler.requests].count('/MK/MK13002.pdf') == 3
+
+    with pytest.raises(DownloadError):
+        downloader.fetch(mirror_url + 'MK13003.pdf')
+    assert [path for path, _ in MirrorHandler.requests].count('/MK/MK13003.pdf') == 1, "Permanent errors are not retried"
+    downloader.close()
+
+
+def test_download_from_directory(tmpdir: Any, monkeypatch: Any) -> None:
+    init_cache(str(tmpdir.join('cache')))
+    tmpdir.join('mirror').mkdir().join('MK13001.pdf').write_binary(b'local issue')
+    monkeypatch.setattr(kozlonyok_hu_downloader, 'base_url', str(tmpdir.join('mirror')))
+    issue = KozlonyToDownload(2013, 1)
+    download_issue(issue)
+    assert issue.get_cache_object().read_bytes() == b'local issue'
+
+
+def test_resumed_download(tmpdir: Any, mirror_url: str) -> None:
+    init_cache(str(tmpdir.join('cache')))
+    MirrorHandler.files['/MK/big.pdf'] = bytes(range(256)) * 1000
+    MirrorHandler.interrupted_responses['/MK/big.pdf'] = 1
+    downloader = Downloader(retry_backoff=0.01, min_request_interval=0)
+    cache_object = CacheObject('big.pdf')
+    downloader.download_to_cache(mirror_url + 'big.pdf', cache_object)
+    assert cache_object.read_bytes() == MirrorHandler.files['/MK/big.pdf']
+    assert MirrorHandler.range_requests == [('/MK/big.pdf', 'bytes=128000-')]
+    assert not os.path.exists(cache_object.get_filename() + '.part')
+    assert not os.path.exists(cache_object.get_filename() + '.part.json')
+
+    # Corrupt files are downloaded again
+    with open(cache_object.get_filename(), 'r+b') as f:
+        f.write(b'corruption')
+    downloader.download_to_cache(mirror_url + 'big.pdf', cache_object)
+    assert cache_object.read_bytes() == MirrorHandler.files['/MK/big.pdf']
+    downloader.close()
+
+
+def test_resume_after_upstream_change(tmpdir: Any, mirror_url: str) -> None:
+    init_cache(str(tmpdir.join('cache')))
+    MirrorHandler.files['/MK/big.pdf'] = b'old' * 1000
+    MirrorHandler.interrupted_responses['/MK/big.pdf'] = 1
+    downloader = Downloader(retries=0, min_request_interval=0)
+    filename = str(tmpdir.join('cache', 'big.pdf'))
+    with pytest.raises(http.client.IncompleteRead):
+        downloader.fetch_to_file(mirror_url + 'big.pdf', filename)
+    assert os.path.getsize(filename + '.part') == 1500
+
+    MirrorHandler.files['/MK/big.pdf'] = b'new' * 1000
+    downloader.fetch_to_file(mirror_url + 'big.pdf', filename)
+    with open(filename, 'rb') as f:
+        assert f.read() == b'new' * 1000, "Partial data of the old version is not kept"
+    assert not MirrorHandler.range_requests
+    downloader.close()
+
+
+def test_resume_with_wrong_content_range(tmpdir: Any, mirror_url: str) -> None:
+    init_cache(str(tmpdir.join('cache')))
+    MirrorHandler.files['/MK/big.pdf'] = bytes(range(256)) * 1000
+    MirrorHandler.interrupted_responses['/MK/big.pdf'] = 1
+    MirrorHandler.wrong_ranges['/MK/big.pdf'] = 1000
+    downloader = Downloader(retry_backoff=0.01, min_request_interval=0)
+    cache_object = CacheObject('big.pdf')
+    downloader.download_to_cache(mirror_url + 'big.pdf', cache_object)
+    assert cache_object.read_bytes() == MirrorHandler.files['/MK/big.pdf']
+    assert len(MirrorHandler.range_requests) == 1
+    downloader.close()
+
+
+def test_revalidation(tmpdir: Any, mirror_url: str) -> None:
+    init_cache(str(tmpdir.join('cache')))
+    downloader = Downloader(retry_backoff=0.01, min_request_interval=0)
+    cache_object = CacheObject('MK13001.pdf')
+    derived_cache_object = CacheObject('MK13001.pdf.parsed_v5.bin')
+    downloader.download_to_cache(mirror_url + 'MK13001.pdf', cache_object)
+    derived_cache_object.write_bytes(b'parsed')
+
+    request_count = len(MirrorHandler.requests)
+    assert not downloader.revalidate_cache(mirror_url + 'MK13001.pdf', cache_object)
+    assert len(MirrorHandler.requests) == request_count + 1
+    assert derived_cache_object.exists()
+
+    MirrorHandler.files['/MK/MK13001.pdf'] = b'corrected issue 1'
+    assert downloader.revalidate_cache(mirror_url + 'MK13001.pdf', cache_object)
+    assert cache_object.read_bytes() == b'corrected issue 1'
+    assert not derived_cache_object.exists()
+    assert not downloader.revalidate_cache(mirror_url + 'MK13001.pdf', cache_object)
+    downloader.close()
+
+
+def test_revalidation_from_directory(tmpdir: Any) -> None:
+    init_cache(str(tmpdir.join('cache')))
+    mirror_file = tmpdir.join('mirror').mkdir().join('MK13001.pdf')
+    mirror_file.write_binary(b'local issue')
+    mirror_file.setmtime(1000000)
+    downloader = Downloader()
+    cache_object = CacheObject('MK13001.pdf')
+    downloader.download_to_cache(str(mirror_file), cache_object)
+    assert not downloader.revalidate_cache(str(mirror_file), cache_object)
+
+    mirror_file.write_binary(b'corrected local issue')
+    mirror_file.setmtime(2000000)
+    assert downloader.revalidate_cache(str(mirror_file), cache_object)
+    assert cache_object.read_bytes() == b'corrected local issue'
@@ -0,0 +1,170 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+import threading
+from typing import Any, Iterable, List, Optional
+
+import attr
+
+from hun_law.cache import init_cache
+from hun_law.cache_keys import CacheStage
+from hun_law.cache_metrics import get_metrics, reset_metrics, update_metrics
+from hun_law.extractors import CachedExtractor, CacheInput, Extractor, Prefetcher, WorkItem
+from hun_law.extractors.all import prefetch, do_extraction, WorkItemQueue
+
+
+class PrefetchTestObject:
+    def __init__(self, num: int):
+        self.num = num
+        self.prefetched = threading.Event()
+
+
+@Prefetcher(PrefetchTestObject)
+def prefetch_test_object(o: PrefetchTestObject) -> None:
+    o.prefetched.set()
+
+
+def test_prefetch() -> None:
+    objects = [PrefetchTestObject(i) for i in range(10)]
+    result = []
+    for o in prefetch(objects, 3):
+        assert o.prefetched.is_set()
+        assert not objects[o.num + 4:] or not objects[o.num + 4].prefetched.is_set(), "Does not prefetch too much"
+        result.append(o.num)
+    assert result == list(range(10))
+
+
+class FilterTestSource:
+    pass
+
+
+class FilterTestItem:
+    extracted_numbers: List[int] = []
+
+    def __init__(self, num: int):
+        self.num = num
+
+
+@Extractor(FilterTestSource)
+def extract_filter_test_items(_source: FilterTestSource) -> Iterable[FilterTestItem]:
+    for i in range(5):
+        yield FilterTestItem(i)
+
+
+@Extractor(FilterTestItem)
+def extract_filter_test_results(item: FilterTestItem) -> Iterable[int]:
+    FilterTestItem.extracted_numbers.append(item.num)
+    yield item.num
+
+
+def test_object_filter() -> None:
+    FilterTestItem.extracted_numbers = []
+    result = do_extraction([FilterTestSource()], (int, ), object_filter=lambda o: not isinstance(o, FilterTestItem) or o.num % 2 == 0)
+    assert sorted(result) == [0, 2, 4]
+    assert sorted(FilterTestItem.extracted_numbers) == [0, 2, 4], "Filtered objects are not processed further"
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class CacheTestSource:
+    name: str
+    content: str
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class CacheTestResult:
+    words: List[str]
+    source: Optional[CacheInput] = None
+
+
+def get_cache_test_input(source: CacheTestSource) -> Optional[CacheInput]:
+    return (source.name, source.content)
+
+
+CACHE_TEST_STAGE = CacheStage('cache_test', ('tests.cheap.test_extraction', ))
+cache_test_calls: List[str] = []
+
+
+@CachedExtractor(CacheTestSource, CacheTestResult, CACHE_TEST_STAGE, get_cache_test_input)
+def extract_cache_test_result(source: CacheTestSource) -> Iterable[CacheTestResult]:
+    cache_test_calls.append(source.name)
+    yield CacheTestResult(source.content.split(), get_cache_test_input(source))
+
+
+def test_cached_extractor(tmpdir: Any) -> None:
+    init_cache(str(tmpdir))
+    reset_metrics()
+    sources = [CacheTestSource('first', 'a b c'), CacheTestSource('second', 'd e')]
+    expected = [CacheTestResult(['a', 'b', 'c'], ('first', 'a b c')), CacheTestResult(['d', 'e'], ('second', 'd e'))]
+    assert list(do_extraction(sources, (CacheTestResult, ))) == expected[::-1]
+    assert list(do_extraction(sources, (CacheTestResult, ))) == expected[::-1]
+    assert sorted(cache_test_calls) == ['first', 'second'], "Results are read from the cache the second time"
+    metrics = get_metrics()['cache_test']
+    assert (metrics.hits, metrics.misses) == (2, 2)
+    assert metrics.bytes_read == metrics.bytes_written > 0
+
+    assert list(do_extraction([CacheTestSource('first', 'a b c d')], (CacheTestResult, ))) == [CacheTestResult(['a', 'b', 'c', 'd'], ('first', 'a b c d'))]
+    assert cache_test_calls.count('first') == 2, "Changed input is extracted again"
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class WorkTestSource:
+    sizes: List[int]
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class WorkTestItem:
+    size: int
+
+
+@WorkItem(WorkTestItem)
+def work_test_item_cost(item: WorkTestItem) -> int:
+    return item.size
+
+
+@Extractor(WorkTestSource)
+def extract_work_test_items(source: WorkTestSource) -> Iterable[WorkTestItem]:
+    for size in source.sizes:
+        yield WorkTestItem(size)
+
+
+@Extractor(WorkTestItem)
+def extract_work_test_results(item: WorkTestItem) -> Iterable[int]:
+    yield item.size
+
+
+def test_work_item_queue() -> None:
+    work_items = WorkItemQueue()
+    for size in (2, 5, 1, 5, 3):
+        work_items.push(WorkTestItem(size))
+    first_big = work_items.pop()
+    assert first_big.size == 5
+    assert work_items.pop() is not first_big, "Equal costs are returned in insertion order"
+    assert [work_items.pop().size for _ in range(len(work_items))] == [3, 2, 1]
+
+
+def test_work_items_in_worker_processes() -> None:
+    sources = [WorkTestSource([1, 7, 3]), WorkTestSource([4])]
+    assert sorted(do_extraction(sources, (int, ), workers=2)) == [1, 3, 4, 7]
+    assert sorted(do_extraction(sources[:1], (int, ), workers=2)) == [1, 3, 7]
+    assert sorted(do_extraction(sources, (int, ))) == [1, 3, 4, 7]
+    assert sorted(do_extraction(sources, (WorkTestItem, ), workers=2)) == [WorkTestItem(1), WorkTestItem(3), WorkTestItem(4), WorkTestItem(7)]
+
+
+def test_worker_metrics_are_not_counted_twice() -> None:
+    reset_metrics()
+    update_metrics('before_workers', hits=1)
+    assert sorted(do_extraction([WorkTestSource([1, 2]), WorkTestSource([3])], (int, ), workers=2)) == [1, 2, 3]
+    assert get_metrics()['before_workers'].hits == 1, "Workers do not send back the metrics inherited from the main process"
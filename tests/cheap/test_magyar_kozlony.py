@@ -0,0 +1,91 @@
+# Copyright 2020 Alex Badics <admin@stickman.hu>
+#
+# This file is part of Hun-Law.
+#
+# Hun-Law is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hun-Law is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hun-Law.  If not, see <https://www.gnu.org/licenses/>.
+
+from typing import Sequence
+
+from hun_law.utils import IndentedLine, IndentedLinePart, EMPTY_LINE, Date
+from hun_law.extractors.pdf import PageOfLines, PdfOfLines
+from hun_law.extractors.magyar_kozlony import select_law_pages, ActIdentifierFilter, MagyarKozlonyLawRawText, MagyarKozlonyHeaderExtractor
+
+
+def page(*lines: str) -> PageOfLines:
+    result = PageOfLines()
+    for l in lines:
+        result.add_line(IndentedLine((IndentedLinePart(10, l),)) if l else EMPTY_LINE)
+    return result
+
+
+FIRST_PAGE = page(
+    "MAGYAR KÖZLÖNY 71 . szám",
+    "",
+    "A MAGYAR KÖZTÁRSASÁG HIVATALOS LAPJA",
+    "2011. június 28., kedd",
+    "",
+    "Tartalomjegyzék",
+    "",
+    "2011. évi LXXX. törvény",
+    "A tesztelésről szóló törvény módosításáról 15203",
+    "2011. évi LXXXI. törvény",
+    "A tesztelés 2011. évi",
+    "elhalasztásáról 15205",
+    "123/2011. (VI. 28.) Korm. rendelet",
+    "Valami rendelet 15210",
+)
+SECOND_PAGE = page(
+    "15202 M A G Y A R   K Ö Z L Ö N Y  •  2011. évi 71 . szám",
+    "",
+    "Tartalomjegyzék",
+    "10/2011. (VI. 28.) OGY határozat",
+    "Valami határozat 15212",
+)
+LAWS_PAGE = page(
+    "M A G Y A R   K Ö Z L Ö N Y  •  2011. évi 71 . szám 15203",
+    "",
+    "II. Törvények",
+)
+
+
+def test_select_law_pages() -> None:
+    assert select_law_pages([FIRST_PAGE], 20) is None
+    assert select_law_pages([FIRST_PAGE, SECOND_PAGE], 20) is None
+    assert select_law_pages([FIRST_PAGE, SECOND_PAGE, LAWS_PAGE], 20) == range(2, 10)
+
+
+def test_select_law_pages_fallbacks() -> None:
+    not_an_mk: Sequence[PageOfLines] = [page("Valami más", "", "", "", "", "Tartalomjegyzék")]
+    assert select_law_pages(not_an_mk, 20) == range(20)
+
+    too_long_toc = [FIRST_PAGE] + [SECOND_PAGE] * 20
+    assert select_law_pages(too_long_toc, 30) == range(30)
+
+    no_laws = page(*(l.content for l in FIRST_PAGE.lines[:6]), "Valami rendelet 15210")
+    assert select_law_pages([no_laws, SECOND_PAGE, LAWS_PAGE], 20) == ()
+
+
+def test_pages_with_header() -> None:
+    kozlony, = MagyarKozlonyHeaderExtractor(PdfOfLines([FIRST_PAGE, SECOND_PAGE]))
+    assert kozlony.publication_date == Date(2011, 6, 28)
+    pages = list(kozlony.pages)
+    assert pages[0].lines[0].content == 'Tartalomjegyzék'
+    assert list(kozlony.pages) == pages, "Pages can be iterated multiple times"
+
+
+def test_act_identifier_filter() -> None:
+    act_filter = ActIdentifierFilter('2011. évi LXXX. törvény')
+    assert act_filter(MagyarKozlonyLawRawText('2011. évi LXXX. törvény', Date(2011, 6, 28), 'Subject', ()))
+    assert not act_filter(MagyarKozlonyLawRawText('2011. évi LXXXI. törvény', Date(2011, 6, 28), 'Subject', ()))
+    assert act_filter(LAWS_PAGE), "Other kinds of objects are not filtered"
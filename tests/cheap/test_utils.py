@@ -20,7 +20,7 @@ from typing import Any, Iterable, Tuple
 import pytest
 
 from hun_law.utils import \
-    IndentedLine, IndentedLinePart, EMPTY_LINE, \
+    IndentedLine, IndentedLinePart, IndentedLinePartInterner, EMPTY_LINE, \
     text_to_int_hun, int_to_text_hun, \
     text_to_int_roman, int_to_text_roman, \
     roman_to_arabic_with_postfix, arabic_to_roman_with_postfix, \
@@ -156,6 +156,19 @@ def test_indented_line_serialization_compactness(tmpdir: Any) -> None:
     assert new_line.slice(50).indent == line.slice(50).indent
 
 
+def test_indented_line_part_interner() -> None:
+    interner = IndentedLinePartInterner()
+    part = interner.get(5.0, 'ő', True)
+    assert part == IndentedLinePart(5.0, 'ő', True)
+    assert interner.get(5.0, 'ő'.encode().decode(), True) is part
+    assert interner.get(5.0, 'ő', False) is not part
+    other_dx = interner.get(6.0, 'ő'.encode().decode(), True)
+    assert other_dx.content is part.content
+    assert interner.hits == 1
+    assert interner.misses == 3
+    assert interner.saved_bytes > 0
+
+
 def test_indented_line_concat() -> None:
     parts1 = (
         IndentedLinePart(5, 'a'),
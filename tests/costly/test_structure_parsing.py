@@ -21,7 +21,7 @@ from typing import Iterable
 from hun_law.extractors.kozlonyok_hu_downloader import KozlonyToDownload
 from hun_law.extractors.act import BlockAmendmentOnlyAct
 from hun_law.extractors.all import do_extraction
-from hun_law.cache import init_cache
+from hun_law.cache import init_cache, set_memory_cache_size
 from hun_law.structure import \
     Act, Book, Part, Title, Chapter, Subtitle, \
     Article, QuotedBlock, AlphabeticPoint, BlockAmendmentContainer, Paragraph
@@ -30,6 +30,8 @@ from hun_law.utils import Date
 
 def parse_single_kozlony(year: int, issue: int) -> Iterable[Act]:
     init_cache(os.path.join(os.path.join(os.path.dirname(__file__), '..', '..'), 'cache'))
+    # Some issues are used by the output generator tests too
+    set_memory_cache_size(2 * 1024 * 1024 * 1024)
     extracted = do_extraction([KozlonyToDownload(year, issue)], (BlockAmendmentOnlyAct, ))
     return (e.act for e in extracted)
 